@@ -0,0 +1,83 @@
+import heapq
+from datetime import datetime, timedelta
+
+
+def _solution_key(solution, parse_price, parse_duration):
+    price = parse_price(solution['price'])
+    if price is None:
+        return None
+    return price, parse_duration(solution['duration'])
+
+
+def best_weekend_pairs(outbound_by_date, return_by_date, parse_price, parse_duration,
+                       return_offset_days=2, top_k=10):
+    """Restituisce le `top_k` migliori combinazioni andata + ritorno dello stesso weekend.
+
+    Le combinazioni sono ordinate per prezzo complessivo e, a parità, per
+    durata totale del viaggio. Invece di confrontare tutte le coppie, le
+    soluzioni di ogni data sono ordinate una volta e le combinazioni vengono
+    generate in ordine crescente con un heap: il costo è
+    O(n log n + (weekend + top_k) log(weekend + top_k)).
+
+    Ogni elemento restituito è un dizionario con le date, le due soluzioni,
+    il prezzo complessivo e la durata totale in minuti.
+    """
+    weekends = []
+    for outbound_date, outbound_solutions in outbound_by_date.items():
+        return_date = (datetime.strptime(outbound_date, '%d-%m-%Y')
+                       + timedelta(days=return_offset_days)).strftime('%d-%m-%Y')
+        legs = []
+        for solutions in (outbound_solutions, return_by_date.get(return_date) or []):
+            keyed = []
+            for solution in solutions:
+                key = _solution_key(solution, parse_price, parse_duration)
+                if key is not None:
+                    keyed.append((key, solution))
+            keyed.sort(key=lambda item: item[0])
+            legs.append(keyed)
+        if legs[0] and legs[1]:
+            weekends.append((outbound_date, return_date, legs[0], legs[1]))
+
+    def entry(w, i, j):
+        (out_price, out_minutes), _ = weekends[w][2][i]
+        (ret_price, ret_minutes), _ = weekends[w][3][j]
+        return (round(out_price + ret_price, 2), out_minutes + ret_minutes, w, i, j)
+
+    # Con le due liste ordinate la coppia (i, j) non è mai migliore di
+    # (i - 1, j) o (i, j - 1): basta espandere i vicini della coppia estratta.
+    heap = [entry(w, 0, 0) for w in range(len(weekends))]
+    heapq.heapify(heap)
+    seen = {(w, 0, 0) for w in range(len(weekends))}
+    best = []
+    while heap and len(best) < top_k:
+        total_price, total_minutes, w, i, j = heapq.heappop(heap)
+        outbound_date, return_date, outbound, inbound = weekends[w]
+        best.append({
+            'outbound_date': outbound_date, 'return_date': return_date,
+            'outbound': outbound[i][1], 'return': inbound[j][1],
+            'total_price': total_price, 'total_minutes': total_minutes,
+        })
+        for ni, nj in ((i + 1, j), (i, j + 1)):
+            if ni < len(outbound) and nj < len(inbound) and (w, ni, nj) not in seen:
+                seen.add((w, ni, nj))
+                heapq.heappush(heap, entry(w, ni, nj))
+    return best
+
+
+def format_digest(title, pairs):
+    """Crea il riepilogo GREZZO (con i segnaposto per il grassetto) delle combinazioni."""
+    lines = [f"*🔁 {title}*"]
+    if not pairs:
+        lines.append("  -> Nessuna combinazione andata/ritorno disponibile con i filtri attuali.")
+        return "\n".join(lines)
+
+    for rank, pair in enumerate(pairs, start=1):
+        out, ret = pair['outbound'], pair['return']
+        hours, minutes = divmod(pair['total_minutes'], 60)
+        price = f"{pair['total_price']:.2f}".replace('.', ',')
+        lines.append(
+            f"{rank}. __BOLD_START__{price} €__BOLD_END__ ({hours}h {minutes}min di viaggio)\n"
+            f"   ➡️ {pair['outbound_date']} {out['departure']} -> {out['arrival']} | {out['price']}\n"
+            f"   ⬅️ {pair['return_date']} {ret['departure']} -> {ret['arrival']} | {ret['price']}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,187 @@
+from abc import ABC, abstractmethod
+import json
+import os
+import sqlite3
+import threading
+
+import requests
+
+import metriche
+
+# --- CONFIGURAZIONE ---
+# Dove salvare lo stato: 'jsonbin', 'file', 'sqlite' oppure 'file+jsonbin' / 'sqlite+jsonbin'
+# (archivio locale con copia remota aggiornata solo quando lo stato cambia)
+STATO_BACKEND = os.environ.get('STATO_BACKEND', 'jsonbin')
+STATO_PERCORSO = os.environ.get('STATO_PERCORSO')
+JSONBIN_BASE_URL = os.environ.get('JSONBIN_BASE_URL', 'https://api.jsonbin.io/v3').rstrip('/')
+# --- FINE CONFIGURAZIONE ---
+
+
+class ArchivioStato(ABC):
+    """Interfaccia comune degli archivi dello stato.
+
+    leggi() restituisce il dizionario salvato ({} se non c'è ancora nulla)
+    oppure None se l'archivio non è raggiungibile; scrivi() restituisce True
+    se lo stato è stato salvato. flush() completa le scritture rimandate.
+    """
+
+    @abstractmethod
+    def leggi(self):
+        ...
+
+    @abstractmethod
+    def scrivi(self, stato):
+        ...
+
+    def flush(self):
+        return True
+
+
+class ArchivioFile(ArchivioStato):
+    """Stato in un file JSON locale, riscritto in modo atomico."""
+
+    def __init__(self, percorso):
+        self.percorso = percorso
+
+    def leggi(self):
+        if not os.path.exists(self.percorso):
+            return {}
+        try:
+            with open(self.percorso, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Errore leggendo {self.percorso}: {e}")
+            return None
+
+    def scrivi(self, stato):
+        temporaneo = f"{self.percorso}.tmp"
+        try:
+            with open(temporaneo, 'w', encoding='utf-8') as f:
+                json.dump(stato, f, ensure_ascii=False)
+            os.replace(temporaneo, self.percorso)
+            return True
+        except OSError as e:
+            print(f"Errore salvando {self.percorso}: {e}")
+            return False
+
+
+class ArchivioSQLite(ArchivioStato):
+    """Stato in un database SQLite locale, una riga per chiave."""
+
+    def __init__(self, percorso, chiave='stato'):
+        self.chiave = chiave
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(percorso, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS stato (chiave TEXT PRIMARY KEY, valore TEXT NOT NULL)")
+
+    def leggi(self):
+        with self._lock:
+            riga = self.conn.execute("SELECT valore FROM stato WHERE chiave = ?", (self.chiave,)).fetchone()
+        return json.loads(riga[0]) if riga else {}
+
+    def scrivi(self, stato):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO stato VALUES (?, ?)",
+                              (self.chiave, json.dumps(stato, ensure_ascii=False)))
+        return True
+
+
+class ArchivioJSONBin(ArchivioStato):
+    """Stato su JSONBin.io (endpoint /latest in lettura, PUT in scrittura)."""
+
+    def __init__(self, bin_id, api_key, base_url=JSONBIN_BASE_URL, timeout=10):
+        self.url = f"{base_url}/b/{bin_id}"
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({'X-Master-Key': api_key or ''})
+
+    def leggi(self):
+        print("--- Leggendo lo stato da JSONBin.io...")
+        try:
+            with metriche.fase('jsonbin_lettura'):
+                res = self.session.get(f"{self.url}/latest", timeout=self.timeout)
+            res.raise_for_status()
+            metriche.aggiungi_byte('jsonbin_lettura', len(res.content))
+            print("--- Stato letto con successo.")
+            return res.json().get('record', {})
+        except Exception as e:
+            print(f"Errore leggendo da JSONBin: {e}")
+            return None
+
+    def scrivi(self, stato):
+        print("--- Salvando il nuovo stato su JSONBin.io...")
+        try:
+            with metriche.fase('jsonbin_scrittura'):
+                res = self.session.put(self.url, json=stato, timeout=self.timeout)
+            res.raise_for_status()
+            metriche.aggiungi_byte('jsonbin_scrittura', len(res.request.body or b''))
+            print("--- Nuovo stato salvato con successo.")
+            return True
+        except Exception as e:
+            print(f"Errore salvando su JSONBin: {e}")
+            return False
+
+
+class ArchivioCoalescente(ArchivioStato):
+    """Archivio locale con copia remota aggiornata in differita (write-behind).
+
+    Le scritture vanno subito nell'archivio locale; la copia remota riceve
+    solo l'ultimo stato, al flush(), e solo se è diverso dall'ultimo letto o
+    inviato. Più scritture tra due flush diventano un'unica richiesta e un
+    errore di rete lascia lo stato in attesa del flush successivo senza
+    interrompere il controllo.
+    """
+
+    def __init__(self, locale, remoto):
+        self.locale = locale
+        self.remoto = remoto
+        self._remoto_noto = None
+        self._in_attesa = None
+
+    def leggi(self):
+        stato = self.locale.leggi()
+        if stato:
+            return stato
+        # Archivio locale vuoto (es. primo avvio su una nuova macchina): parte dalla copia remota
+        stato = self.remoto.leggi()
+        if stato:
+            self._remoto_noto = stato
+            self.locale.scrivi(stato)
+        return stato
+
+    def scrivi(self, stato):
+        if not self.locale.scrivi(stato):
+            return False
+        self._in_attesa = None if stato == self._remoto_noto else stato
+        return True
+
+    def flush(self):
+        if self._in_attesa is None:
+            return True
+        if not self.remoto.scrivi(self._in_attesa):
+            return False
+        self._remoto_noto, self._in_attesa = self._in_attesa, None
+        return True
+
+
+def crea_archivio(nome, backend=None, percorso=None):
+    """Crea l'archivio configurato con STATO_BACKEND per lo script `nome`."""
+    backend = backend or STATO_BACKEND
+    percorso = percorso or STATO_PERCORSO
+    locale, _, remoto = backend.partition('+')
+
+    archivi = []
+    for tipo in filter(None, (locale, remoto)):
+        if tipo == 'file':
+            archivi.append(ArchivioFile(percorso or f"stato_{nome}.json"))
+        elif tipo == 'sqlite':
+            archivi.append(ArchivioSQLite(percorso or 'stato.sqlite', chiave=nome))
+        elif tipo == 'jsonbin':
+            archivi.append(ArchivioJSONBin(os.environ.get('JSONBIN_ID'), os.environ.get('JSONBIN_API_KEY')))
+        else:
+            raise ValueError(f"Backend di stato sconosciuto: {tipo}")
+
+    if len(archivi) == 2:
+        return ArchivioCoalescente(*archivi)
+    return archivi[0]
@@ -0,0 +1,266 @@
+"""Benchmark offline degli scraper sulle pagine e sulle risposte salvate in fixtures/.
+
+Le richieste HTTP vanno a server_simulato in locale, quindi il benchmark non
+dipende dalla rete. Per ogni fase riporta throughput, percentili di latenza
+e picco di memoria (tracemalloc) e salva i risultati in JSON, per confrontare
+versioni diverse.
+
+Fasi:
+  lefrecce_parsing   extract_solutions_from_html + filter_solutions (pagine dei risultati)
+  lefrecce_http      lefrecce_api.search_solutions (stazioni + soluzioni a pagine)
+  biglietti_parsing  ogni strategia di monitor_biglietti.estrai_biglietti
+  biglietti_http     monitor_biglietti.scarica_biglietti (download, impronta e parsing)
+  turni_http         report_prezzi.scarica_turni su 6 mesi
+  turni_filtro       indicizza_turni_per_data + valuta_regole
+
+Uso: python benchmark.py [ripetizioni] [risultati.json] [confronto.json]
+"""
+import contextlib
+import glob
+import json
+import math
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, time as time_obj, timedelta
+
+import cerca_treni
+import lefrecce_api
+import monitor_biglietti
+import report_prezzi
+from server_simulato import avvia_server
+
+CARTELLA_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FILE_RISULTATI = 'benchmark_risultati.json'
+# Variazione della mediana oltre la quale il confronto segnala una regressione
+SOGLIA_REGRESSIONE = 0.10
+
+
+def _fixtures(sottocartella, schema):
+    """File delle fixture in ordine naturale (pagina_3 prima di pagina_40)."""
+    percorsi = glob.glob(os.path.join(CARTELLA_FIXTURES, sottocartella, schema))
+    return sorted(percorsi, key=lambda p: [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', p)])
+
+
+def _leggi(percorso, modo='r'):
+    with open(percorso, modo, **({} if 'b' in modo else {'encoding': 'utf-8'})) as f:
+        return f.read()
+
+
+def _percentile(ordinati, p):
+    """Percentile con il metodo nearest-rank su una lista già ordinata."""
+    indice = max(0, min(len(ordinati) - 1, math.ceil(p / 100 * len(ordinati)) - 1))
+    return ordinati[indice]
+
+
+def misura(funzione, argomento, ripetizioni, byte=0):
+    """Esegue la funzione più volte e restituisce latenze, throughput e picco di memoria.
+
+    L'output degli script (print) viene scartato durante la misura.
+    """
+    tempi = []
+    with open(os.devnull, 'w') as nulla, contextlib.redirect_stdout(nulla):
+        for _ in range(ripetizioni):
+            inizio = time.perf_counter()
+            funzione(argomento)
+            tempi.append(time.perf_counter() - inizio)
+
+        tracemalloc.start()
+        funzione(argomento)
+        _, picco = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    ordinati = sorted(tempi)
+    totale = sum(tempi)
+    risultato = {
+        'ripetizioni': ripetizioni,
+        'mediana_ms': statistics.median(tempi) * 1000,
+        'p90_ms': _percentile(ordinati, 90) * 1000,
+        'p99_ms': _percentile(ordinati, 99) * 1000,
+        'minimo_ms': ordinati[0] * 1000,
+        'operazioni_al_secondo': ripetizioni / totale if totale else None,
+        'picco_memoria_kb': picco / 1024,
+    }
+    if byte:
+        risultato['mb_al_secondo'] = byte * ripetizioni / totale / 1e6 if totale else None
+    return risultato
+
+
+def rotte_fixtures():
+    """Rotte del server simulato che servono le fixture.
+
+    Le API di lefrecce sono sotto /lefrecce/<caso>/website, con le soluzioni
+    della giornata restituite a pagine secondo offset/limit della richiesta.
+    """
+    rotte = {}
+    stazioni = _leggi(os.path.join(CARTELLA_FIXTURES, 'lefrecce', 'stazioni.json'), 'rb')
+    for percorso in _fixtures('lefrecce', 'soluzioni_*.json'):
+        caso = os.path.splitext(os.path.basename(percorso))[0]
+        giornata = json.loads(_leggi(percorso))
+
+        def soluzioni(richiesta, giornata=giornata):
+            criteri = json.loads(richiesta['body'])['criteria']
+            pagina = giornata['solutions'][criteri['offset']:criteri['offset'] + criteri['limit']]
+            return 200, {}, {**giornata, 'solutions': pagina}
+
+        rotte[('GET', f'/lefrecce/{caso}/website/locations/search')] = lambda richiesta: (200, {}, stazioni)
+        rotte[('POST', f'/lefrecce/{caso}/website/ticket/solutions')] = soluzioni
+
+    for percorso in _fixtures('biglietti', '*.html'):
+        pagina = _leggi(percorso, 'rb')
+        rotte[('GET', f'/biglietti/{os.path.basename(percorso)}')] = (
+            lambda richiesta, pagina=pagina: (200, {'Content-Type': 'text/html; charset=utf-8'}, pagina))
+
+    turni = _leggi(os.path.join(CARTELLA_FIXTURES, 'turni', 'turni_6_mesi.json'), 'rb')
+    rotte[('GET', '/api/hya/shifts')] = lambda richiesta: (200, {}, turni)
+    return rotte
+
+
+def bench_lefrecce_parsing(ripetizioni):
+    """Parsing e filtri di cerca_treni sulle pagine dei risultati salvate."""
+    risultati = []
+    for percorso in _fixtures('lefrecce', 'risultati_*.html'):
+        html = _leggi(percorso)
+        elabora = lambda pagina: cerca_treni.filter_solutions(
+            cerca_treni.extract_solutions_from_html(pagina), time_obj(6, 0), time_obj(20, 0), 240)
+        risultati.append({'fase': 'lefrecce_parsing', 'caso': os.path.basename(percorso),
+                          'elementi': len(cerca_treni.extract_solutions_from_html(html)),
+                          **misura(elabora, html, ripetizioni, len(html.encode('utf-8')))})
+    return risultati
+
+
+def bench_lefrecce_http(ripetizioni, url_server):
+    """Ricerca con il backend HTTP di cerca_treni, fino a MAX_PAGES pagine per giornata."""
+    risultati = []
+    for percorso in _fixtures('lefrecce', 'soluzioni_*.json'):
+        caso = os.path.splitext(os.path.basename(percorso))[0]
+        lefrecce_api.LEFRECCE_API_URL = f"{url_server}/lefrecce/{caso}/website"
+        lefrecce_api._station_ids.clear()
+        cerca = lambda data: lefrecce_api.search_solutions('Roma Termini', 'Milano Centrale', data, 5,
+                                                           until=time_obj(23, 59))
+        risultati.append({'fase': 'lefrecce_http', 'caso': caso, 'elementi': len(cerca('04-12-2026')),
+                          **misura(cerca, '04-12-2026', ripetizioni, os.path.getsize(percorso))})
+    return risultati
+
+
+def bench_parsing_biglietti(ripetizioni):
+    """Confronta le strategie di parsing di monitor_biglietti su ogni pagina salvata.
+
+    Prima verifica che tutte le strategie estraggano gli stessi record.
+    """
+    risultati = []
+    for percorso in _fixtures('biglietti', '*.html'):
+        html = _leggi(percorso)
+        pagina = os.path.basename(percorso)
+
+        riferimento = monitor_biglietti.estrai_biglietti(html, 'soup')
+        for nome, funzione in monitor_biglietti.STRATEGIE_PARSING.items():
+            if funzione(html) != riferimento:
+                raise AssertionError(f"La strategia '{nome}' estrae record diversi da 'soup' su {pagina}")
+            risultati.append({'fase': 'biglietti_parsing', 'caso': f"{pagina} [{nome}]", 'elementi': len(riferimento),
+                              **misura(funzione, html, ripetizioni, len(html.encode('utf-8')))})
+    return risultati
+
+
+def bench_biglietti_http(ripetizioni, url_server):
+    """Controllo completo di una pagina (senza stato precedente) con la strategia predefinita."""
+    risultati = []
+    session = monitor_biglietti.crea_sessione()
+    for percorso in _fixtures('biglietti', '*.html'):
+        pagina = os.path.basename(percorso)
+        scarica = lambda url: monitor_biglietti.scarica_biglietti({}, url, session)[0]
+        url = f"{url_server}/biglietti/{pagina}"
+        risultati.append({'fase': 'biglietti_http', 'caso': pagina, 'elementi': len(scarica(url)),
+                          **misura(scarica, url, ripetizioni, os.path.getsize(percorso))})
+    return risultati
+
+
+def bench_turni(ripetizioni, url_server):
+    """Download dei turni su 6 mesi e valutazione delle regole di report_prezzi."""
+    report_prezzi.API_SHIFTS = f"{url_server}/api/hya/shifts"
+    percorso = os.path.join(CARTELLA_FIXTURES, 'turni', 'turni_6_mesi.json')
+    inizio = date(2026, 10, 1)
+    fine = inizio + timedelta(days=182)
+    scarica = lambda intervallo: report_prezzi.scarica_turni(*intervallo, '1')
+    with open(os.devnull, 'w') as nulla, contextlib.redirect_stdout(nulla):
+        dati = scarica((inizio, fine))
+
+    tutti_i_giorni = [inizio + timedelta(days=g) for g in range(183)]
+    regole = [
+        {'excursion_id': '1', 'pickup': ['08:30'], 'date': tutti_i_giorni},
+        {'excursion_id': '1', 'pickup': None, 'date': [g for g in tutti_i_giorni if g.weekday() == 5]},
+        {'excursion_id': '1', 'pickup': ['07:30', '13:00'], 'date': tutti_i_giorni[:60]},
+    ]
+    filtra = lambda turni: report_prezzi.valuta_regole(report_prezzi.indicizza_turni_per_data(turni), regole)
+
+    return [
+        {'fase': 'turni_http', 'caso': '6 mesi', 'elementi': len(dati['TURNOS']),
+         **misura(scarica, (inizio, fine), ripetizioni, os.path.getsize(percorso))},
+        {'fase': 'turni_filtro', 'caso': f"6 mesi, {len(regole)} regole", 'elementi': len(dati['TURNOS']),
+         **misura(filtra, dati['TURNOS'], ripetizioni)},
+    ]
+
+
+def esegui_benchmark(ripetizioni):
+    """Esegue tutte le fasi e restituisce il documento con metadati e risultati."""
+    server, url_server = avvia_server(rotte_fixtures())
+    try:
+        risultati = (bench_lefrecce_parsing(ripetizioni) + bench_lefrecce_http(ripetizioni, url_server)
+                     + bench_parsing_biglietti(ripetizioni) + bench_biglietti_http(ripetizioni, url_server)
+                     + bench_turni(ripetizioni, url_server))
+    finally:
+        server.shutdown()
+
+    try:
+        versione = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        versione = None
+    return {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'versione': versione,
+        'python': platform.python_version(),
+        'piattaforma': platform.platform(),
+        'ripetizioni': ripetizioni,
+        'risultati': risultati,
+    }
+
+
+def confronta(precedente, attuale):
+    """Stampa la variazione della mediana per ogni fase presente in entrambi i file."""
+    vecchi = {(r['fase'], r['caso']): r for r in precedente['risultati']}
+    print(f"\nConfronto con {precedente.get('versione') or '?'} del {precedente.get('data', '?')}:")
+    for r in attuale['risultati']:
+        vecchio = vecchi.get((r['fase'], r['caso']))
+        if vecchio is None or not vecchio['mediana_ms']:
+            continue
+        variazione = r['mediana_ms'] / vecchio['mediana_ms'] - 1
+        segnale = " ⚠️ regressione" if variazione > SOGLIA_REGRESSIONE else ""
+        print(f"{r['fase']:<18} {r['caso']:<36} {vecchio['mediana_ms']:>9.2f} -> {r['mediana_ms']:>9.2f} ms "
+              f"({variazione:+.0%}){segnale}")
+
+
+if __name__ == '__main__':
+    ripetizioni = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    file_risultati = sys.argv[2] if len(sys.argv) > 2 else FILE_RISULTATI
+
+    documento = esegui_benchmark(ripetizioni)
+    print(f"{'fase':<18} {'caso':<36} {'elem.':>6} {'mediana ms':>11} {'p90 ms':>8} {'p99 ms':>8} "
+          f"{'op/s':>8} {'MB/s':>7} {'picco KB':>9}")
+    for r in documento['risultati']:
+        mb = f"{r['mb_al_secondo']:>7.1f}" if r.get('mb_al_secondo') else f"{'-':>7}"
+        print(f"{r['fase']:<18} {r['caso']:<36} {r['elementi']:>6} {r['mediana_ms']:>11.2f} {r['p90_ms']:>8.2f} "
+              f"{r['p99_ms']:>8.2f} {r['operazioni_al_secondo']:>8.1f} {mb} {r['picco_memoria_kb']:>9.0f}")
+
+    with open(file_risultati, 'w', encoding='utf-8') as f:
+        json.dump(documento, f, indent=2, ensure_ascii=False)
+    print(f"\nRisultati salvati in {file_risultati}")
+
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], encoding='utf-8') as f:
+            confronta(json.load(f), documento)
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+# --- CONFIGURAZIONE ---
+CACHE_PATH = os.environ.get('CERCA_TRENI_CACHE', 'cache_treni.sqlite')
+# Le date entro questi giorni vengono ricontrollate a ogni esecuzione
+ALWAYS_CHECK_WITHIN_DAYS = 60
+# Per le date più lontane l'intervallo di ricontrollo è una frazione del tempo
+# trascorso dall'ultima variazione, fino a questo massimo
+RECHECK_FRACTION = 0.5
+MAX_RECHECK_SECONDS = 3 * 24 * 3600
+# --- FINE CONFIGURAZIONE ---
+
+
+def solutions_hash(solutions):
+    """Impronta del contenuto delle soluzioni, indipendente dall'ordine."""
+    normalized = sorted(json.dumps(s, sort_keys=True, ensure_ascii=False) for s in solutions)
+    return hashlib.sha256("\n".join(normalized).encode('utf-8')).hexdigest()
+
+
+def time_window(search):
+    return f"{search['start_time_filter'].strftime('%H:%M')}-{search['end_time_filter'].strftime('%H:%M')}"
+
+
+class ResultCache:
+    """Cache persistente delle soluzioni per (partenza, arrivo, data, fascia oraria)."""
+
+    def __init__(self, path=CACHE_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                departure_station TEXT NOT NULL,
+                arrival_station TEXT NOT NULL,
+                date TEXT NOT NULL,
+                time_window TEXT NOT NULL,
+                solutions TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                last_checked REAL NOT NULL,
+                last_changed REAL NOT NULL,
+                PRIMARY KEY (departure_station, arrival_station, date, time_window)
+            )
+        """)
+
+    def _key(self, search, date):
+        return (search['departure_station'], search['arrival_station'], date, time_window(search))
+
+    def get(self, search, date):
+        row = self.conn.execute(
+            "SELECT solutions, content_hash, last_checked, last_changed FROM results "
+            "WHERE departure_station = ? AND arrival_station = ? AND date = ? AND time_window = ?",
+            self._key(search, date)).fetchone()
+        if row is None:
+            return None
+        return {'solutions': json.loads(row[0]), 'content_hash': row[1],
+                'last_checked': row[2], 'last_changed': row[3]}
+
+    def check_times(self, search):
+        """Ultimo controllo di ogni data della ricerca: {data: timestamp}, con una sola query."""
+        key = self._key(search, None)
+        return dict(self.conn.execute(
+            "SELECT date, last_checked FROM results "
+            "WHERE departure_station = ? AND arrival_station = ? AND time_window = ?",
+            (key[0], key[1], key[3])))
+
+    def is_due(self, search, date, now=None):
+        """Indica se la data va ricontrollata in questa esecuzione."""
+        now = now or time.time()
+        entry = self.get(search, date)
+        if entry is None:
+            return True
+        days_ahead = (datetime.strptime(date, '%d-%m-%Y') - datetime.fromtimestamp(now)).days
+        if days_ahead <= ALWAYS_CHECK_WITHIN_DAYS:
+            return True
+        interval = min(MAX_RECHECK_SECONDS, (now - entry['last_changed']) * RECHECK_FRACTION)
+        return now - entry['last_checked'] >= interval
+
+    def is_changed(self, search, date, solutions):
+        """Indica se le soluzioni sono diverse da quelle salvate, senza salvarle."""
+        entry = self.get(search, date)
+        return entry is None or entry['content_hash'] != solutions_hash(solutions)
+
+    def update(self, search, date, solutions, now=None):
+        """Salva le soluzioni e restituisce True se sono cambiate rispetto all'ultima volta."""
+        now = now or time.time()
+        new_hash = solutions_hash(solutions)
+        entry = self.get(search, date)
+        changed = entry is None or entry['content_hash'] != new_hash
+        last_changed = now if changed else entry['last_changed']
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (*self._key(search, date), json.dumps(solutions, ensure_ascii=False),
+                 new_hash, now, last_changed))
+        return changed
+
+    def purge_before(self, date_obj):
+        """Elimina le voci di date ormai passate."""
+        stale = [row for row in self.conn.execute("SELECT rowid, date FROM results")
+                 if datetime.strptime(row[1], '%d-%m-%Y') < date_obj]
+        with self.conn:
+            self.conn.executemany("DELETE FROM results WHERE rowid = ?", [(row[0],) for row in stale])
+
+    def close(self):
+        self.conn.close()
@@ -1,61 +1,130 @@
+import atexit
+import json
 import os
-import requests
+import queue
+import re
+import shutil
+import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, time as time_obj
 import urllib.parse
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
+# selenium, webdriver_manager e bs4 sono importati solo dove servono: con il
+# backend HTTP, o se tutte le date sono in cache, non vengono mai caricati.
+
+import lefrecce_api
+import metriche
+import notifiche_telegram
+from abbinamenti import best_weekend_pairs, format_digest
+from cache_risultati import ResultCache
+from pianificazione import BUDGET_REQUESTS, BUDGET_SECONDS, plan_searches, route_key
+from storico_prezzi import PriceHistory
+
+# Istante di caricamento del modulo, per misurare il tempo fino alla prima ricerca
+STARTED_AT = time.perf_counter()
+
+# --- CONFIGURAZIONE ---
+LEFRECCE_HANDOFF_URL = "https://www.lefrecce.it/Channels.Website.WEB/website/auth/handoff"
+
+# Backend di ricerca: 'selenium' (browser headless) o 'http' (API JSON, con ripiego su Selenium)
+BACKEND = os.environ.get('CERCA_TRENI_BACKEND', 'selenium').lower()
+# Estrazione dei risultati: 'dom' (script eseguito nella pagina) o 'soup' (page_source + BeautifulSoup)
+EXTRACTION_MODE = os.environ.get('CERCA_TRENI_EXTRACTION', 'dom').lower()
+# Numero di browser headless usati in parallelo (default: numero di CPU)
+POOL_SIZE = int(os.environ.get('CERCA_TRENI_POOL_SIZE') or os.cpu_count() or 1)
+# Intervallo minimo in secondi tra due richieste verso lo stesso sito
+MIN_REQUEST_INTERVAL = float(os.environ.get('CERCA_TRENI_MIN_INTERVAL', '1.0'))
+# Finestra delle date cercate, in giorni da oggi
+WINDOW_START_DAYS = int(os.environ.get('CERCA_TRENI_WINDOW_START', '50'))
+WINDOW_END_DAYS = int(os.environ.get('CERCA_TRENI_WINDOW_END', '120'))
+# Percorso di chromedriver: se non indicato viene risolto con webdriver_manager
+# una sola volta e salvato in CHROMEDRIVER_CACHE, rivalidato sulla versione di Chrome
+CHROMEDRIVER_PATH = os.environ.get('CHROMEDRIVER_PATH')
+CHROMEDRIVER_CACHE = os.environ.get('CERCA_TRENI_DRIVER_CACHE',
+                                    os.path.expanduser('~/.cache/cerca_treni/chromedriver.json'))
+CHROME_BINARIES = ['google-chrome', 'google-chrome-stable', 'chromium', 'chromium-browser']
+# Indirizzo host:porta di un Chrome già avviato con --remote-debugging-port a cui
+# collegarsi invece di avviarne uno nuovo (il pool usa allora un solo driver)
+DEBUGGER_ADDRESS = os.environ.get('CERCA_TRENI_DEBUGGER_ADDRESS')
+# Mantiene aperti i browser tra un'esecuzione e l'altra di main_scraper nello stesso processo
+KEEP_BROWSER = os.environ.get('CERCA_TRENI_KEEP_BROWSER', '0') == '1'
+# Oltre questo tempo un caricamento di pagina è considerato bloccato
+PAGE_LOAD_TIMEOUT = 60
+# Attesa massima dei risultati dopo il caricamento della pagina
+RESULTS_TIMEOUT = 20
+# Pagina caricata, nessuna fetch/XHR in corso e nessuna nuova richiesta per questi secondi: rete ferma
+NETWORK_IDLE_SECONDS = 3.0
+# Strategia di caricamento di Chrome: 'eager' non attende immagini e fogli di stile
+PAGE_LOAD_STRATEGY = os.environ.get('CERCA_TRENI_PAGE_LOAD_STRATEGY', 'eager')
+# Blocca immagini, font e script di analytics (disattivare con CERCA_TRENI_BLOCK_RESOURCES=0)
+BLOCK_RESOURCES = os.environ.get('CERCA_TRENI_BLOCK_RESOURCES', '1') != '0'
+BLOCKED_URL_PATTERNS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*facebook.net*', '*hotjar.com*',
+]
+# Testi (in minuscolo) che identificano la pagina senza soluzioni o una pagina di errore.
+# Sono cercati solo nel contenitore dei risultati oppure, se manca, nella pagina
+# completa e senza richieste in corso; il captcha è riconosciuto solo dagli elementi.
+RESULTS_CONTAINER_SELECTOR = '.search-results, .solutions-list'
+CAPTCHA_SELECTOR = 'iframe[src*="captcha"], .g-recaptcha, .h-captcha, #captcha'
+NO_RESULTS_MARKERS = ['nessuna soluzione', 'non ci sono soluzioni', 'nessun risultato']
+BLOCKED_MARKERS = ['access denied', 'accesso negato']
+ERROR_MARKERS = ['si è verificato un errore', 'servizio non disponibile', 'service unavailable', 'errore tecnico']
+
+SEARCHES = [
+    {
+        'id': 'roma-milano-venerdi',
+        'title': 'Ricerca Venerdì (Roma -> Milano)',
+        'banner': 'INIZIO RICERCA VENERDÌ (ROMA -> MILANO)',
+        'weekday': 4,
+        'departure_station': 'Roma Termini', 'arrival_station': 'Milano Centrale',
+        'departure_hour': '16',
+        'start_time_filter': time_obj(16, 0), 'end_time_filter': time_obj(18, 30),
+        'max_duration_minutes': 200,
+    },
+    {
+        'id': 'milano-roma-domenica',
+        'title': 'Ricerca Domeniche (Milano -> Roma)',
+        'banner': 'INIZIO RICERCA DOMENICHE (MILANO -> ROMA)',
+        'weekday': 6,
+        'departure_station': 'Milano Centrale', 'arrival_station': 'Roma Termini',
+        'departure_hour': '14',
+        'start_time_filter': time_obj(14, 0), 'end_time_filter': time_obj(17, 0),
+        'max_duration_minutes': 200,
+    },
+]
+
+# Combinazioni andata/ritorno dello stesso weekend da riassumere in un unico messaggio
+ROUND_TRIPS = [
+    {
+        'title': 'Migliori weekend Roma <-> Milano (venerdì + domenica)',
+        'outbound': 'roma-milano-venerdi', 'return': 'milano-roma-domenica',
+        'return_offset_days': 2, 'top_k': 10,
+    },
+]
+# --- FINE CONFIGURAZIONE ---
 
 def escape_markdown_v2(text):
     """Esegue l'escape dei caratteri speciali per la modalità MarkdownV2 di Telegram."""
     escape_chars = r'_*[]()~`>#+-=|{}.!'
     return ''.join(f'\\{char}' if char in escape_chars else char for char in str(text))
 
-def send_telegram_message(message):
-    """Invia un messaggio a una chat di Telegram."""
-    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
-    chat_id = os.environ.get('TELEGRAM_CHAT_ID')
-
-    if not bot_token or not chat_id:
-        print("ERRORE: Le variabili d'ambiente TELEGRAM_BOT_TOKEN e TELEGRAM_CHAT_ID non sono impostate.")
-        return
-
+def format_telegram_message(message):
+    """Prepara il testo per la modalità MarkdownV2, con i segnaposto del grassetto."""
     # Esegui l'escape globale e poi sostituisci i segnaposto per il grassetto
     escaped_message = escape_markdown_v2(message)
-    final_message = escaped_message.replace(escape_markdown_v2("__BOLD_START__"), "*").replace(escape_markdown_v2("__BOLD_END__"), "*")
-
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    payload = {
-        'chat_id': chat_id,
-        'text': final_message,
-        'parse_mode': 'MarkdownV2'
-    }
-    
-    response = requests.post(url, json=payload)
-    if response.status_code == 200:
-        print("✅ Messaggio inviato con successo a Telegram!")
-    else:
-        print(f"❌ Errore nell'invio del messaggio a Telegram: {response.status_code} - {response.text}")
+    return escaped_message.replace(escape_markdown_v2("__BOLD_START__"), "*").replace(escape_markdown_v2("__BOLD_END__"), "*")
 
 def get_target_weekdays(start_days, end_days, weekday_to_find):
     """Genera una lista di date per un dato giorno della settimana."""
-    dates = []
-    today = datetime.today()
-    start_date = today + timedelta(days=start_days)
-    end_date = today + timedelta(days=end_days)
-    
-    current_date = start_date
-    while current_date <= end_date:
-        if current_date.weekday() == weekday_to_find:
-            dates.append(current_date.strftime('%d-%m-%Y'))
-        current_date += timedelta(days=1)
-    
-    return dates
+    start_date = datetime.today() + timedelta(days=start_days)
+    # Primo giorno utile della finestra, poi una data ogni 7 giorni
+    offset = (weekday_to_find - start_date.weekday()) % 7
+    weeks = (end_days - start_days - offset) // 7 + 1
+    return [(start_date + timedelta(days=offset + 7 * week)).strftime('%d-%m-%Y') for week in range(max(0, weeks))]
 
 def parse_duration(duration_str):
     """Converte una stringa come '3h 10min' in minuti totali."""
@@ -74,129 +143,687 @@ def parse_duration(duration_str):
         return 9999
     return total_minutes
 
-def scrape_results_for_date(driver, search_date, params, start_time_filter, end_time_filter, max_duration_minutes, price_threshold):
-    """Esegue lo scraping per una data e restituisce una lista di risultati testuali GREZZI."""
-    results = []
-    full_url = f"https://www.lefrecce.it/Channels.Website.WEB/website/auth/handoff?{urllib.parse.urlencode(params)}"
-    driver.get(full_url)
+def parse_price(price_str):
+    """Converte una stringa come '39,90 €' in float (None se non è un prezzo)."""
+    try:
+        return float(price_str.replace('€', '').replace(',', '.').strip())
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+def extract_solutions_from_html(page_html):
+    """Estrae dall'HTML della pagina risultati una lista di soluzioni normalizzate."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(page_html, 'html.parser')
+    solutions = []
+    for train in soup.find_all('div', class_='solution'):
+        time_elements = train.select('div.od-info b')
+        duration_element = train.select_one('div.duration strong')
+
+        if len(time_elements) < 2 or not duration_element:
+            continue
+
+        price_element = train.find('title2', class_='solution-price-size')
+        solutions.append({
+            'departure': time_elements[0].text.strip(),
+            'arrival': time_elements[1].text.strip(),
+            'duration': duration_element.text.strip(),
+            'price': price_element.text.strip() if price_element else "N/D",
+        })
+    return solutions
+
+# Estrae le soluzioni direttamente nella pagina, con gli stessi selettori usati
+# da extract_solutions_from_html: al posto dell'intero HTML torna solo un
+# elenco compatto di dizionari.
+EXTRACT_SOLUTIONS_JS = """
+const text = (el) => el ? el.textContent.trim() : null;
+const solutions = [];
+for (const train of document.querySelectorAll('div.solution')) {
+    const times = train.querySelectorAll('div.od-info b');
+    const duration = train.querySelector('div.duration strong');
+    if (times.length < 2 || !duration) continue;
+    const price = train.querySelector('title2.solution-price-size');
+    solutions.push({
+        departure: text(times[0]),
+        arrival: text(times[1]),
+        duration: text(duration),
+        price: price ? text(price) : 'N/D',
+    });
+}
+return solutions;
+"""
+
+def extract_solutions_in_browser(driver):
+    """Estrae le soluzioni eseguendo EXTRACT_SOLUTIONS_JS nel browser.
+
+    Se lo script non restituisce una lista ripiega sul parsing di page_source.
+    """
+    solutions = driver.execute_script(EXTRACT_SOLUTIONS_JS)
+    if not isinstance(solutions, list):
+        return extract_solutions_from_html(driver.page_source)
+    return solutions
+
+def filter_solutions(solutions, start_time_filter, end_time_filter, max_duration_minutes):
+    """Applica i filtri su orario di partenza e durata massima."""
+    filtered = []
+    for solution in solutions:
+        try:
+            current_departure_time = datetime.strptime(solution['departure'], '%H:%M').time()
+            duration_in_minutes = parse_duration(solution['duration'])
+        except ValueError:
+            continue
+
+        if (start_time_filter <= current_departure_time <= end_time_filter) and (duration_in_minutes <= max_duration_minutes):
+            filtered.append(solution)
+    return filtered
+
+# Iniettato in ogni pagina prima dei suoi script: conta le fetch/XHR ancora in
+# corso, che non compaiono tra le risorse di performance finché non terminano.
+PENDING_REQUESTS_JS = """
+window.__pendingRequests = 0;
+const done = () => { window.__pendingRequests = Math.max(0, window.__pendingRequests - 1); };
+const originalFetch = window.fetch;
+if (originalFetch) {
+    window.fetch = function (...args) {
+        window.__pendingRequests++;
+        try {
+            const request = originalFetch.apply(this, args);
+            request.then(done, done);
+            return request;
+        } catch (e) {
+            done();
+            throw e;
+        }
+    };
+}
+const originalSend = XMLHttpRequest.prototype.send;
+XMLHttpRequest.prototype.send = function (...args) {
+    window.__pendingRequests++;
+    this.addEventListener('loadend', done, { once: true });
+    try {
+        return originalSend.apply(this, args);
+    } catch (e) {
+        this.removeEventListener('loadend', done);
+        done();
+        throw e;
+    }
+};
+"""
+
+# Restituisce 'solutions', 'no_results', 'blocked' o 'error' appena la pagina
+# lo rende riconoscibile, altrimenti [readyState, numero di risorse caricate,
+# richieste in corso (null se il contatore non è stato iniettato)].
+PAGE_STATE_JS = """
+const [noResults, blocked, errors, containerSelector, captchaSelector] = arguments;
+if (document.querySelector('div.solution')) return 'solutions';
+if ([...document.querySelectorAll(captchaSelector)].some((e) => e.offsetWidth || e.offsetHeight)) return 'blocked';
+const pending = typeof window.__pendingRequests === 'number' ? window.__pendingRequests : null;
+const settled = document.readyState === 'complete' && !pending;
+const scope = document.querySelector(containerSelector) || (settled ? document.body : null);
+if (scope) {
+    const text = scope.innerText.toLowerCase();
+    if (blocked.some((m) => text.includes(m))) return 'blocked';
+    if (noResults.some((m) => text.includes(m))) return 'no_results';
+    if (errors.some((m) => text.includes(m))) return 'error';
+}
+return [document.readyState, performance.getEntriesByType('resource').length, pending];
+"""
+
+class PageOutcome:
+    """Condizione per WebDriverWait che riconosce il primo esito disponibile della ricerca.
+
+    Oltre agli esiti letti dalla pagina restituisce 'stalled' quando la pagina
+    è completa, non ha fetch/XHR in corso e non parte alcuna nuova richiesta
+    per NETWORK_IDLE_SECONDS. Senza il contatore delle richieste in corso
+    (PENDING_REQUESTS_JS) la pagina non viene mai considerata ferma e vale
+    solo il timeout.
+    """
+
+    def __init__(self):
+        self._resources = None
+        self._idle_since = None
+
+    def __call__(self, driver):
+        state = driver.execute_script(PAGE_STATE_JS, NO_RESULTS_MARKERS, BLOCKED_MARKERS, ERROR_MARKERS,
+                                      RESULTS_CONTAINER_SELECTOR, CAPTCHA_SELECTOR)
+        if isinstance(state, str):
+            return state
+
+        ready_state, resources, pending = state
+        now = time.monotonic()
+        if ready_state != 'complete' or pending != 0 or resources != self._resources:
+            self._resources = resources
+            self._idle_since = now
+            return False
+        if now - self._idle_since >= NETWORK_IDLE_SECONDS:
+            return 'stalled'
+        return False
 
+def wait_for_results(driver, timeout=RESULTS_TIMEOUT):
+    """Attende il primo esito riconoscibile e restituisce (esito, secondi trascorsi)."""
+    from selenium.common.exceptions import JavascriptException, TimeoutException
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    start = time.monotonic()
     try:
-        WebDriverWait(driver, 20).until(
-            EC.presence_of_element_located((By.CLASS_NAME, "solution"))
-        )
-        print(f"✅ Risultati trovati per il {search_date}! Applico i filtri...")
-
-        page_html = driver.page_source
-        soup = BeautifulSoup(page_html, 'html.parser')
-        train_results = soup.find_all('div', class_='solution')
-        
-        trains_found_in_range = 0
-        for train in train_results:
-            # ... (estrazione dati come prima)
-            time_elements = train.select('div.od-info b')
-            duration_element = train.select_one('div.duration strong')
+        # Durante la navigazione lo script può fallire (contesto distrutto): si riprova
+        outcome = WebDriverWait(driver, timeout, poll_frequency=0.25,
+                                ignored_exceptions=(JavascriptException,)).until(PageOutcome())
+    except TimeoutException:
+        outcome = 'timeout'
+    return outcome, time.monotonic() - start
 
-            if len(time_elements) < 2 or not duration_element:
-                continue
+class SearchError(Exception):
+    """La pagina dei risultati non è stata caricata correttamente."""
+
+def scrape_solutions_for_date(driver, search_date, params, start_time_filter, end_time_filter, max_duration_minutes):
+    """Esegue lo scraping per una data e restituisce le soluzioni normalizzate che superano i filtri.
+
+    Solleva SearchError se i risultati non sono stati caricati.
+    """
+    full_url = f"{LEFRECCE_HANDOFF_URL}?{urllib.parse.urlencode(params)}"
+
+    try:
+        with metriche.fase('driver_get'):
+            driver.get(full_url)
+        with metriche.fase('attesa_risultati'):
+            outcome, elapsed = wait_for_results(driver)
+    except Exception as e:
+        raise SearchError(f"Errore: {e}") from e
+    metriche.conta(f"esito_{outcome}")
+    if outcome == 'no_results':
+        print(f"ℹ️ Nessuna soluzione per il {search_date} ({elapsed:.1f}s).")
+        return []
+    if outcome != 'solutions':
+        print(f"❌ Esito '{outcome}' per il {search_date} dopo {elapsed:.1f}s.")
+        raise SearchError(f"Esito: {outcome} dopo {elapsed:.1f}s.")
+    print(f"✅ Risultati trovati per il {search_date} in {elapsed:.1f}s! Applico i filtri...")
+
+    try:
+        if EXTRACTION_MODE == 'dom':
+            with metriche.fase('estrazione_dom'):
+                solutions = extract_solutions_in_browser(driver)
+        else:
+            page_source = driver.page_source
+            metriche.aggiungi_byte('page_source', len(page_source))
+            with metriche.fase('estrazione_soup'):
+                solutions = extract_solutions_from_html(page_source)
+    except Exception as e:
+        raise SearchError(f"Errore: {e}") from e
+    return filter_solutions(solutions, start_time_filter, end_time_filter, max_duration_minutes)
+
+def error_row(error):
+    return f"  -> Non è stato possibile caricare i risultati. {error}"
+
+def scrape_solutions_http(search_date, search, wait_turn=None):
+    """Esegue la stessa ricerca tramite le API JSON di lefrecce, senza browser.
 
-            departure_time_str = time_elements[0].text.strip()
-            arrival_time_str = time_elements[1].text.strip()
-            duration_str = duration_element.text.strip()
-            
+    `wait_turn` viene chiamato prima di ogni richiesta (vedi DriverPool.wait_turn).
+    Solleva un'eccezione in caso di errore, così il chiamante può ripiegare su Selenium.
+    """
+    solutions = lefrecce_api.search_solutions(search['departure_station'], search['arrival_station'],
+                                              search_date, search['departure_hour'],
+                                              until=search['end_time_filter'], wait_turn=wait_turn)
+    print(f"✅ Risultati ricevuti via HTTP per il {search_date}! Applico i filtri...")
+    return filter_solutions(solutions, search['start_time_filter'], search['end_time_filter'],
+                            search['max_duration_minutes'])
+
+def _major_version(command):
+    """Versione principale (es. '126') stampata da `command --version`, o None."""
+    try:
+        output = subprocess.run([command, '--version'], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r'(\d+)\.\d+', output)
+    return match.group(1) if match else None
+
+def _chrome_major_version():
+    for binary in CHROME_BINARIES:
+        path = shutil.which(binary)
+        if path:
+            return _major_version(path)
+    return None
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+def resolve_chromedriver():
+    """Restituisce il percorso di chromedriver, risolto al massimo una volta per processo.
+
+    Il percorso salvato in CHROMEDRIVER_CACHE viene riusato se il file esiste
+    e la sua versione principale coincide con quella di Chrome installato;
+    altrimenti viene chiesto a webdriver_manager e salvato di nuovo.
+    """
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path:
+            return _driver_path
+        if CHROMEDRIVER_PATH:
+            _driver_path = CHROMEDRIVER_PATH
+            return _driver_path
+
+        chrome_version = _chrome_major_version()
+        try:
+            with open(CHROMEDRIVER_CACHE, encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+        path = cached.get('path')
+        if path and os.path.isfile(path):
+            driver_version = _major_version(path)
+            if driver_version and (chrome_version is None or driver_version == chrome_version):
+                _driver_path = path
+                return _driver_path
+            print(f"ℹ️ chromedriver {driver_version} non compatibile con Chrome {chrome_version}: lo aggiorno.")
+
+        from webdriver_manager.chrome import ChromeDriverManager
+
+        path = ChromeDriverManager().install()
+        try:
+            os.makedirs(os.path.dirname(CHROMEDRIVER_CACHE) or '.', exist_ok=True)
+            with open(CHROMEDRIVER_CACHE, 'w', encoding='utf-8') as f:
+                json.dump({'path': path, 'driver_version': _major_version(path),
+                           'chrome_version': chrome_version}, f)
+        except OSError as e:
+            print(f"⚠️ Impossibile salvare il percorso di chromedriver: {e}")
+        _driver_path = path
+        return _driver_path
+
+def create_driver():
+    """Avvia un nuovo Chrome headless con i timeout di caricamento impostati.
+
+    Con CERCA_TRENI_DEBUGGER_ADDRESS si collega invece al Chrome già in esecuzione.
+    """
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service as ChromeService
+
+    options = webdriver.ChromeOptions()
+    if DEBUGGER_ADDRESS:
+        options.add_experimental_option("debuggerAddress", DEBUGGER_ADDRESS)
+    else:
+        options.add_argument("--headless")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        options.add_argument("window-size=1920,1080")
+        if BLOCK_RESOURCES:
+            options.add_experimental_option("prefs", {
+                "profile.managed_default_content_settings.images": 2,
+            })
+    options.page_load_strategy = PAGE_LOAD_STRATEGY
+
+    with metriche.fase('chromedriver_manager'):
+        service = ChromeService(resolve_chromedriver())
+    with metriche.fase('chrome_avvio'):
+        driver = webdriver.Chrome(service=service, options=options)
+    # Un driver bloccato non deve trattenere il worker all'infinito: scaduto il
+    # timeout driver.get solleva un'eccezione e il driver viene riciclato.
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    driver.set_script_timeout(PAGE_LOAD_TIMEOUT)
+    driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': PENDING_REQUESTS_JS})
+    if BLOCK_RESOURCES:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+    return driver
+
+def quit_driver(driver):
+    """Chiude il driver; un browser a cui ci si è collegati resta aperto."""
+    if DEBUGGER_ADDRESS:
+        driver.service.stop()
+    else:
+        driver.quit()
+
+def driver_is_alive(driver):
+    """Verifica che il driver risponda ancora ai comandi."""
+    try:
+        driver.execute_script("return 1")
+        return True
+    except Exception:
+        return False
+
+class DriverPool:
+    """Pool limitato di driver Chrome riutilizzabili, condiviso tra più thread.
+
+    I driver vengono creati solo quando servono (fino a `size`), restituiti al
+    pool dopo ogni ricerca e sostituiti se si bloccano o vanno in crash.
+    Le richieste verso lo stesso host sono distanziate di almeno
+    `min_interval` secondi, indipendentemente dal numero di driver.
+    """
+
+    def __init__(self, size, min_interval=0.0):
+        self.size = max(1, size)
+        self.min_interval = min_interval
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def acquire(self):
+        """Restituisce un driver libero, avviandone uno nuovo se il pool non è pieno.
+
+        Solleva l'eccezione di create_driver se il browser non si avvia.
+        """
+        while True:
             try:
-                current_departure_time = datetime.strptime(departure_time_str, '%H:%M').time()
-                duration_in_minutes = parse_duration(duration_str)
-            except ValueError:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    return create_driver()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            # Pool pieno: si attende un driver restituito, ricontrollando ogni
+            # tanto nel caso un avvio fallito abbia liberato un posto
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
                 continue
 
-            if (start_time_filter <= current_departure_time <= end_time_filter) and (duration_in_minutes <= max_duration_minutes):
-                trains_found_in_range += 1
-                price_element = train.find('title2', class_='solution-price-size')
-                price_str = price_element.text.strip() if price_element else "N/D"
-                
-                # **NUOVA LOGICA**
-                # Crea la stringa del prezzo con i segnaposto se necessario
-                price_formatted = f"Prezzo: a partire da {price_str}"
-                try:
-                    price_float = float(price_str.replace('€', '').replace(',', '.'))
-                    if price_float < price_threshold:
-                        price_formatted = f"__BOLD_START__💰 Prezzo: a partire da {price_str}__BOLD_END__"
-                except (ValueError, TypeError):
-                    pass
-
-                # Aggiungi la riga GREZZA alla lista dei risultati
-                results.append(f"  🕒 {departure_time_str} -> {arrival_time_str} ({duration_str}) | {price_formatted}")
-        
-        if trains_found_in_range == 0:
-            results.append("  -> Nessun treno trovato che soddisfi tutti i filtri per questa data.")
+    def release(self, driver, healthy=True):
+        if healthy:
+            self._idle.put(driver)
+        else:
+            print("♻️ Driver non più reattivo: lo chiudo e ne avvio uno nuovo.")
+            metriche.conta('driver_riciclati')
+            self._discard(driver)
 
-    except Exception as e:
-        results.append(f"  -> Non è stato possibile caricare i risultati. Errore: {e}")
-    
-    return results
+    def _discard(self, driver):
+        try:
+            quit_driver(driver)
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def wait_turn(self, url):
+        """Attende il proprio turno per rispettare l'intervallo minimo per host."""
+        if self.min_interval <= 0:
+            return
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def close(self):
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+
+_warm_pool = None
+
+def get_pool():
+    """Restituisce il pool di driver per un'esecuzione.
+
+    Con CERCA_TRENI_KEEP_BROWSER=1 il pool (e i browser già avviati) resta
+    aperto fino all'uscita del processo e viene riusato dalle esecuzioni
+    successive. Collegandosi a un browser esistente si usa un solo driver.
+    """
+    global _warm_pool
+    size = 1 if DEBUGGER_ADDRESS else POOL_SIZE
+    if not KEEP_BROWSER:
+        return DriverPool(size, min_interval=MIN_REQUEST_INTERVAL)
+    if _warm_pool is None:
+        _warm_pool = DriverPool(size, min_interval=MIN_REQUEST_INTERVAL)
+        atexit.register(_warm_pool.close)
+    return _warm_pool
+
+class FirstQueryTimer:
+    """Misura il tempo tra l'avvio di un'esecuzione e la prima ricerca completata."""
+
+    def __init__(self, start):
+        self.start = start
+        self.elapsed = None
+        self._lock = threading.Lock()
+
+    def mark(self):
+        with self._lock:
+            if self.elapsed is not None:
+                return
+            self.elapsed = time.perf_counter() - self.start
+        print(f"⏱️ Prima ricerca completata {self.elapsed:.2f}s dopo l'avvio.")
+        metriche.imposta('tempo_prima_ricerca_s', round(self.elapsed, 3))
+
+def build_search_params(search, date):
+    """Costruisce i parametri dell'URL di ricerca lefrecce per una data."""
+    return {
+        'action': 'searchTickets', 'lang': 'it', 'referrer': 'www.trenitalia.com',
+        'tripType': 'on', 'ynFlexibleDates': 'off', 'departureDate': date,
+        'departureStation': search['departure_station'], 'departureTime': search['departure_hour'],
+        'arrivalStation': search['arrival_station'], 'selectedTrainType': 'tutti',
+        'noOfChildren': '0', 'noOfAdults': '1',
+    }
 
+def run_search_job(pool, search, date):
+    """Esegue la ricerca di una data con il backend configurato.
+
+    Restituisce (soluzioni filtrate, None) oppure (None, errore), anche quando
+    non si riesce ad avviare un browser. Con il backend HTTP un errore fa
+    ripiegare la ricerca su un driver del pool; il driver viene riciclato se
+    non risponde più.
+    """
+    if BACKEND == 'http':
+        try:
+            with metriche.fase('ricerca_http'):
+                return scrape_solutions_http(date, search, wait_turn=pool.wait_turn), None
+        except Exception as e:
+            metriche.conta('ripieghi_selenium')
+            print(f"⚠️ Backend HTTP non disponibile per il {date} ({e}). Ripiego su Selenium...")
+
+    params = build_search_params(search, date)
+    for attempt in range(2):
+        try:
+            driver = pool.acquire()
+        except Exception as e:
+            # Senza browser fallisce solo questa data, non l'intera esecuzione
+            metriche.conta('driver_non_avviati')
+            print(f"❌ Impossibile avviare un browser per il {date}: {e}")
+            return None, SearchError(f"Browser non disponibile: {e}")
+        healthy = False
+        try:
+            with metriche.fase('attesa_turno_host'):
+                pool.wait_turn(LEFRECCE_HANDOFF_URL)
+            try:
+                outcome = scrape_solutions_for_date(driver, date, params,
+                                                    start_time_filter=search['start_time_filter'],
+                                                    end_time_filter=search['end_time_filter'],
+                                                    max_duration_minutes=search['max_duration_minutes']), None
+            except SearchError as e:
+                outcome = None, e
+            healthy = driver_is_alive(driver)
+        finally:
+            pool.release(driver, healthy)
+        if healthy or attempt == 1:
+            return outcome
+        print(f"🔁 Ripeto la ricerca del {date} con un nuovo driver...")
+
+def format_euro(value):
+    return f"{value:.2f}".replace('.', ',') + " €"
+
+def format_alert_row(solution, alert):
+    """Riga GREZZA del report per un treno con un nuovo minimo o un calo di prezzo."""
+    trip = f"  🕒 {solution['departure']} -> {solution['arrival']} ({solution['duration']})"
+    if alert['kind'] == 'new_minimum':
+        note = f"nuovo minimo, prima {format_euro(alert['previous_min'])}" if alert['previous_min'] is not None else "prima rilevazione"
+        return f"{trip} | __BOLD_START__💰 Prezzo: {solution['price']}__BOLD_END__ ({note})"
+    return (f"{trip} | __BOLD_START__📉 Prezzo: {solution['price']}__BOLD_END__ "
+            f"(-{alert['drop_percent']:.0f}% da {format_euro(alert['previous_price'])}, "
+            f"minimo storico {format_euro(alert['min_price'])})")
+
+def price_alert_rows(history, search, date, solutions):
+    """Righe dei soli treni da segnalare, confrontando i prezzi con lo storico senza registrarli."""
+    route = route_key(search)
+    rows = []
+    for solution in solutions:
+        price = parse_price(solution['price'])
+        if price is None:
+            continue
+        alert = history.alert_for(route, date, solution['departure'], price)
+        if alert:
+            rows.append(format_alert_row(solution, alert))
+    return rows
+
+def record_prices(history, search, date, solutions):
+    """Registra nello storico i prezzi delle soluzioni di una data."""
+    route = route_key(search)
+    for solution in solutions:
+        price = parse_price(solution['price'])
+        if price is not None:
+            history.record(route, date, solution['departure'], price)
+
+def send_round_trip_digests(cache, outbox, pending=None):
+    """Accoda il riepilogo delle migliori combinazioni andata/ritorno per ogni voce di ROUND_TRIPS.
+
+    Usa le ultime soluzioni note: quelle di `pending` ({(id ricerca, data):
+    (ricerca, soluzioni)}, trovate in questa esecuzione e non ancora salvate)
+    e altrimenti quelle nella cache, comprese le date non ricontrollate.
+    """
+    pending = pending or {}
+    searches = {search['id']: search for search in SEARCHES}
+    for trip in ROUND_TRIPS:
+        solutions_by_leg = []
+        for leg in ('outbound', 'return'):
+            search = searches[trip[leg]]
+            by_date = {}
+            for date in get_target_weekdays(WINDOW_START_DAYS, WINDOW_END_DAYS, search['weekday']):
+                if (search['id'], date) in pending:
+                    by_date[date] = pending[(search['id'], date)][1]
+                    continue
+                entry = cache.get(search, date)
+                if entry is not None:
+                    by_date[date] = entry['solutions']
+            solutions_by_leg.append(by_date)
+
+        pairs = best_weekend_pairs(*solutions_by_leg, parse_price, parse_duration,
+                                   return_offset_days=trip['return_offset_days'], top_k=trip['top_k'])
+        outbox.accoda(format_telegram_message(format_digest(trip['title'], pairs)))
+
+_runs = 0
+
+@metriche.esecuzione('cerca_treni')
 def main_scraper():
-    """Funzione principale che avvia il browser ed esegue le ricerche."""
-    print("🤖 Avvio del browser in modalità headless...")
-    
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("window-size=1920,1080")
-    
-    service = ChromeService(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=options)
+    """Funzione principale che avvia il pool di browser ed esegue le ricerche."""
+    global _runs
+    # La prima esecuzione del processo conta anche gli import del modulo
+    first_query = FirstQueryTimer(STARTED_AT if _runs == 0 else time.perf_counter())
+    _runs += 1
+    # Le date passate non servono più né alla cache né allo storico dei prezzi
+    today = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+    cache = ResultCache()
+    cache.purge_before(today)
+    history = PriceHistory()
+    history.purge_before(today)
+    outbox = notifiche_telegram.CodaTelegram(parse_mode='MarkdownV2')
+
+    # Le date più promettenti (vicine, con prezzi volatili, non controllate da
+    # tempo) vengono cercate per prime, entro l'eventuale budget dell'esecuzione
+    candidates = [(search, get_target_weekdays(WINDOW_START_DAYS, WINDOW_END_DAYS, search['weekday']))
+                  for search in SEARCHES]
+    planned, skipped = plan_searches(candidates, cache, history)
+    jobs = [(search, date) for _, search, date in planned]
+
+    metriche.conta('ricerche', len(jobs))
+    metriche.conta('date_rimandate', skipped)
+    budget = ", ".join(filter(None, [BUDGET_REQUESTS and f"{BUDGET_REQUESTS} ricerche",
+                                     BUDGET_SECONDS and f"{BUDGET_SECONDS:g}s"])) or "nessuno"
+    # Con il backend HTTP i browser vengono avviati solo se serve ripiegare su Selenium
+    print(f"🤖 Avvio delle {len(jobs)} ricerche (backend: {BACKEND}, fino a {1 if DEBUGGER_ADDRESS else POOL_SIZE} browser, "
+          f"budget: {budget}), {skipped} date rimandate...")
+    pool = get_pool()
+    deadline = time.monotonic() + BUDGET_SECONDS if BUDGET_SECONDS else None
+
+    def run_job(job):
+        # Superato il budget di tempo le ricerche ancora in coda (le meno prioritarie) vengono rimandate
+        if deadline is not None and time.monotonic() > deadline:
+            return None, None
+        result = run_search_job(pool, *job)
+        first_query.mark()
+        return result
 
     try:
-        # --- 1. RICERCA VENERDÌ (ANDATA) ---
-        fridays = get_target_weekdays(50, 120, 4)
-        if fridays:
-            print("\n" + "#"*20 + " INIZIO RICERCA VENERDÌ (ROMA -> MILANO) " + "#"*20)
-            for date in fridays:
-                # Titolo grezzo con i segnaposto per il grassetto
-                day_report = [f"*🚄 Ricerca Venerdì (Roma -> Milano)*\n*Data: {date}*"]
-                params = {
-                    'action': 'searchTickets', 'lang': 'it', 'referrer': 'www.trenitalia.com',
-                    'tripType': 'on', 'ynFlexibleDates': 'off', 'departureDate': date,
-                    'departureStation': 'Roma Termini', 'departureTime': '16',
-                    'arrivalStation': 'Milano Centrale', 'selectedTrainType': 'tutti',
-                    'noOfChildren': '0', 'noOfAdults': '1',
-                }
-                results = scrape_results_for_date(driver, date, params, 
-                                                  start_time_filter=time_obj(16, 0), 
-                                                  end_time_filter=time_obj(18, 30), 
-                                                  max_duration_minutes=200,
-                                                  price_threshold=42.0)
-                day_report.extend(results)
-                send_telegram_message("\n".join(day_report))
-                time.sleep(1)
-
-        # --- 2. RICERCA DOMENICHE (RITORNO) ---
-        sundays = get_target_weekdays(50, 120, 6)
-        if sundays:
-            print("\n" + "#"*20 + " INIZIO RICERCA DOMENICHE (MILANO -> ROMA) " + "#"*20)
-            for date in sundays:
-                day_report = [f"*🚄 Ricerca Domeniche (Milano -> Roma)*\n*Data: {date}*"]
-                params = {
-                    'action': 'searchTickets', 'lang': 'it', 'referrer': 'www.trenitalia.com',
-                    'tripType': 'on', 'ynFlexibleDates': 'off', 'departureDate': date,
-                    'departureStation': 'Milano Centrale', 'departureTime': '14',
-                    'arrivalStation': 'Roma Termini', 'selectedTrainType': 'tutti',
-                    'noOfChildren': '0', 'noOfAdults': '1',
-                }
-                results = scrape_results_for_date(driver, date, params, 
-                                                  start_time_filter=time_obj(14, 0), 
-                                                  end_time_filter=time_obj(17, 0), 
-                                                  max_duration_minutes=200,
-                                                  price_threshold=42.0)
-                day_report.extend(results)
-                send_telegram_message("\n".join(day_report))
-                time.sleep(1)
+        with ThreadPoolExecutor(max_workers=pool.size) as executor:
+            # map restituisce i risultati nell'ordine di priorità delle ricerche,
+            # qualunque sia l'ordine in cui terminano.
+            all_results = list(executor.map(run_job, jobs))
+
+        # Il report segue l'ordine di SEARCHES e delle date, non quello di priorità
+        order = {search['id']: index for index, search in enumerate(SEARCHES)}
+        report = sorted(zip(jobs, all_results),
+                        key=lambda item: (order[item[0][0]['id']], datetime.strptime(item[0][1], '%d-%m-%Y')))
+
+        current_search = None
+        unchanged = 0
+        deferred = 0
+        any_changed = False
+        # Date cambiate: cache e storico vengono aggiornati solo dopo l'invio dei loro avvisi
+        pending = {}
+        for (search, date), (solutions, error) in report:
+            if solutions is None and error is None:
+                deferred += 1
+                continue
+            if search is not current_search:
+                current_search = search
+                print("\n" + "#"*20 + f" {search['banner']} " + "#"*20)
+
+            if error is not None:
+                results = [error_row(error)]
+            elif not cache.is_changed(search, date, solutions):
+                cache.update(search, date, solutions)
+                unchanged += 1
+                continue
+            else:
+                any_changed = True
+                pending[(search['id'], date)] = (search, solutions)
+                results = price_alert_rows(history, search, date, solutions)
+                if not results:
+                    unchanged += 1
+                    continue
+
+            # Titolo grezzo con i segnaposto per il grassetto
+            day_report = [f"*🚄 {search['title']}*\n*Data: {date}*"]
+            day_report.extend(results)
+            outbox.accoda(format_telegram_message("\n".join(day_report)), chiave=(search['id'], date))
+        print(f"\nℹ️ {unchanged} date senza nuovi minimi o cali di prezzo: nessun messaggio inviato.")
+        if deferred:
+            print(f"⏳ Budget di tempo esaurito: {deferred} ricerche rimandate alla prossima esecuzione.")
+            metriche.conta('ricerche_oltre_budget', deferred)
+
+        if any_changed:
+            send_round_trip_digests(cache, outbox, pending)
+
+        # Gli avvisi sono raggruppati in pochi messaggi invece di uno per data
+        outbox.svuota()
+
+        # Le date con avvisi non consegnati restano come prima: alla prossima
+        # esecuzione risultano ancora cambiate e gli avvisi vengono ripetuti
+        for (search_id, date), (search, solutions) in pending.items():
+            if (search_id, date) in outbox.non_consegnati:
+                continue
+            cache.update(search, date, solutions)
+            record_prices(history, search, date, solutions)
+        undelivered = outbox.non_consegnati & pending.keys()
+        if undelivered:
+            print(f"⚠️ Avvisi di {len(undelivered)} date non consegnati: verranno ripetuti alla prossima esecuzione.")
 
     finally:
-        print("\nRicerca completata. Chiusura del browser.")
-        driver.quit()
+        if pool is _warm_pool:
+            print("\nRicerca completata. I browser restano aperti per la prossima esecuzione.")
+        else:
+            print("\nRicerca completata. Chiusura dei browser.")
+            pool.close()
+        cache.close()
+        history.close()
 
 if __name__ == "__main__":
     main_scraper()
@@ -0,0 +1,121 @@
+"""Processo residente che esegue monitor_biglietti e report_prezzi con un pianificatore interno.
+
+Al posto di un job GitHub Actions per ogni controllo (avvio del runner,
+pip install, nuova connessione e nuovo download dello stato ogni volta)
+i moduli restano caricati, le sessioni HTTP restano aperte e ogni
+obiettivo adatta il proprio intervallo:
+  - dopo una variazione torna all'intervallo minimo;
+  - finché non cambia nulla l'intervallo raddoppia, fino al massimo;
+  - vicino alla data dell'evento l'intervallo massimo si riduce.
+
+Uso: python demone.py   (con le stesse variabili d'ambiente degli script;
+per lo stato di monitor_biglietti conviene STATO_BACKEND=file+jsonbin)
+"""
+import heapq
+import os
+import random
+import signal
+import threading
+import time
+from datetime import datetime
+
+import monitor_biglietti
+import report_prezzi
+
+# --- CONFIGURAZIONE ---
+FATTORE_CRESCITA = 2.0
+# Entro questi giorni dall'evento l'intervallo massimo si riduce in proporzione
+GIORNI_VICINANZA = 14
+# Variazione casuale degli intervalli, per non interrogare i siti a orari fissi
+JITTER = 0.1
+
+
+def _minuti(variabile, default):
+    return float(os.environ.get(variabile, default)) * 60
+
+
+def _date_report_prezzi():
+    """Date di tutte le regole della watchlist di report_prezzi (HYA_WATCHLIST o configurazione classica)."""
+    try:
+        regole = report_prezzi.carica_watchlist()
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[demone] Watchlist di report_prezzi non leggibile: {e}")
+        return []
+    return sorted({datetime.combine(data, datetime.min.time()) for regola in regole for data in regola['date']})
+
+
+OBIETTIVI = [
+    {
+        'nome': 'monitor_biglietti',
+        'funzione': monitor_biglietti.esegui_controllo,
+        'intervallo_min': _minuti('DEMONE_MONITOR_MIN', 3),
+        'intervallo_base': _minuti('DEMONE_MONITOR_BASE', 11),
+        'intervallo_max': _minuti('DEMONE_MONITOR_MAX', 60),
+        'date_evento': lambda: [],
+    },
+    {
+        'nome': 'report_prezzi',
+        'funzione': report_prezzi.job_principale,
+        'intervallo_min': _minuti('DEMONE_REPORT_MIN', 10),
+        'intervallo_base': _minuti('DEMONE_REPORT_BASE', 30),
+        'intervallo_max': _minuti('DEMONE_REPORT_MAX', 180),
+        'date_evento': _date_report_prezzi,
+    },
+]
+# --- FINE CONFIGURAZIONE ---
+
+
+def prossimo_intervallo(obiettivo, intervallo, cambiato, adesso=None):
+    """Calcola l'attesa prima del prossimo controllo di un obiettivo (in secondi)."""
+    if cambiato:
+        intervallo = obiettivo['intervallo_min']
+    else:
+        intervallo = intervallo * FATTORE_CRESCITA
+
+    massimo = obiettivo['intervallo_max']
+    adesso = adesso or datetime.now()
+    giorni = [(data - adesso).total_seconds() / 86400 for data in obiettivo['date_evento']()]
+    giorni = [g for g in giorni if g >= 0]
+    if giorni:
+        vicinanza = min(1.0, min(giorni) / GIORNI_VICINANZA)
+        massimo = max(obiettivo['intervallo_min'], massimo * vicinanza)
+
+    intervallo = min(max(intervallo, obiettivo['intervallo_min']), massimo)
+    return intervallo * random.uniform(1 - JITTER, 1 + JITTER)
+
+
+def avvia_demone(obiettivi=OBIETTIVI, stop=None):
+    """Esegue gli obiettivi finché `stop` non viene impostato (SIGINT/SIGTERM)."""
+    stop = stop or threading.Event()
+    coda = [(time.monotonic(), indice) for indice in range(len(obiettivi))]
+    heapq.heapify(coda)
+    intervalli = [obiettivo['intervallo_base'] for obiettivo in obiettivi]
+
+    while not stop.is_set():
+        scadenza, indice = heapq.heappop(coda)
+        if stop.wait(max(0.0, scadenza - time.monotonic())):
+            break
+
+        obiettivo = obiettivi[indice]
+        print(f"\n[demone] {datetime.now().strftime('%H:%M:%S')} controllo '{obiettivo['nome']}'")
+        try:
+            cambiato = bool(obiettivo['funzione']())
+        except Exception as e:
+            print(f"[demone] Errore in '{obiettivo['nome']}': {e}")
+            # Dopo un errore si riprova all'intervallo base, senza allungare l'attesa
+            intervalli[indice] = obiettivo['intervallo_base'] / FATTORE_CRESCITA
+            cambiato = False
+
+        attesa = prossimo_intervallo(obiettivo, intervalli[indice], cambiato)
+        intervalli[indice] = attesa
+        print(f"[demone] '{obiettivo['nome']}': {'variazione' if cambiato else 'nessuna variazione'}, "
+              f"prossimo controllo tra {attesa / 60:.1f} minuti")
+        heapq.heappush(coda, (time.monotonic() + attesa, indice))
+
+
+if __name__ == '__main__':
+    evento_stop = threading.Event()
+    for segnale in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(segnale, lambda *_: evento_stop.set())
+    avvia_demone(stop=evento_stop)
+    print("[demone] Arresto richiesto, chiusura.")
@@ -0,0 +1,140 @@
+import os
+import threading
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metriche
+
+# --- CONFIGURAZIONE ---
+# Base delle API JSON usate dal sito lefrecce.it. Può puntare a un server locale
+# (vedi server_simulato.py) per provare la ricerca con risposte registrate.
+LEFRECCE_API_URL = os.environ.get('LEFRECCE_API_URL', 'https://www.lefrecce.it/Channels.Website.BFF.WEB/website').rstrip('/')
+
+REQUEST_TIMEOUT = 20
+PAGE_SIZE = 10
+MAX_PAGES = 5
+# --- FINE CONFIGURAZIONE ---
+
+_session = None
+_session_lock = threading.Lock()
+_station_ids = {}
+
+
+class LefrecceError(Exception):
+    """Risposta inattesa dalle API di lefrecce."""
+
+
+def get_session():
+    """Restituisce la sessione HTTP condivisa (connessioni keep-alive riutilizzate tra i thread)."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(4, os.cpu_count() or 1))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36',
+                'Accept': 'application/json',
+                'Accept-Language': 'it-IT',
+            })
+            _session = session
+        return _session
+
+
+def find_station_id(name, wait_turn=None):
+    """Restituisce l'id della stazione con il nome indicato (con cache in memoria).
+
+    `wait_turn`, se indicato, viene chiamato con l'URL prima di ogni richiesta
+    (es. DriverPool.wait_turn, per rispettare l'intervallo minimo per host).
+    """
+    if name in _station_ids:
+        return _station_ids[name]
+
+    url = f"{LEFRECCE_API_URL}/locations/search"
+    if wait_turn:
+        wait_turn(url)
+    res = get_session().get(url,
+                            params={'name': name, 'limit': 10}, timeout=REQUEST_TIMEOUT)
+    res.raise_for_status()
+    locations = res.json()
+    if not locations:
+        raise LefrecceError(f"Stazione non trovata: {name}")
+
+    exact = [loc for loc in locations if loc.get('name', '').lower() == name.lower()]
+    station_id = (exact or locations)[0]['id']
+    _station_ids[name] = station_id
+    return station_id
+
+
+def _format_time(iso_str):
+    return datetime.fromisoformat(iso_str[:19]).strftime('%H:%M')
+
+
+def _format_price(price):
+    if not price or price.get('amount') is None:
+        return "N/D"
+    return f"{price['amount']:.2f}".replace('.', ',') + f" {price.get('currency') or '€'}"
+
+
+def normalize_solution(item):
+    """Converte una soluzione delle API nel formato estratto dalla pagina dei risultati."""
+    solution = item.get('solution', item)
+    return {
+        'departure': _format_time(solution['departureTime']),
+        'arrival': _format_time(solution['arrivalTime']),
+        'duration': solution.get('duration', ''),
+        'price': _format_price(solution.get('price')),
+    }
+
+
+def search_solutions(departure_station, arrival_station, date, departure_hour, until=None, wait_turn=None):
+    """Cerca le soluzioni per una data ('dd-mm-YYYY') a partire dall'ora indicata.
+
+    Se `until` è un orario, continua a chiedere pagine successive finché le
+    partenze non lo superano (al massimo MAX_PAGES pagine). `wait_turn` come
+    in find_station_id, chiamato prima di ogni pagina.
+    """
+    day = datetime.strptime(date, '%d-%m-%Y')
+    body = {
+        'departureLocationId': find_station_id(departure_station, wait_turn),
+        'arrivalLocationId': find_station_id(arrival_station, wait_turn),
+        'departureTime': day.replace(hour=int(departure_hour)).strftime('%Y-%m-%dT%H:%M:%S.000'),
+        'adults': 1,
+        'children': 0,
+        'criteria': {
+            'frecceOnly': False, 'regionalOnly': False, 'noChanges': False,
+            'order': 'DEPARTURE_DATE', 'offset': 0, 'limit': PAGE_SIZE,
+        },
+        'advancedSearchRequest': {'bestFare': False},
+    }
+
+    url = f"{LEFRECCE_API_URL}/ticket/solutions"
+    solutions = []
+    for page in range(MAX_PAGES):
+        body['criteria']['offset'] = page * PAGE_SIZE
+        if wait_turn:
+            wait_turn(url)
+        res = get_session().post(url, json=body, timeout=REQUEST_TIMEOUT)
+        res.raise_for_status()
+        metriche.conta('lefrecce_api_richieste')
+        metriche.aggiungi_byte('lefrecce_api', len(res.content))
+        data = res.json()
+        if 'solutions' not in data:
+            raise LefrecceError(f"Risposta senza soluzioni: {str(data)[:200]}")
+
+        page_solutions = []
+        for item in data['solutions']:
+            try:
+                page_solutions.append(normalize_solution(item))
+            except (KeyError, TypeError, ValueError):
+                continue
+        solutions.extend(page_solutions)
+
+        if len(data['solutions']) < PAGE_SIZE or until is None or not page_solutions:
+            break
+        if datetime.strptime(page_solutions[-1]['departure'], '%H:%M').time() > until:
+            break
+    return solutions
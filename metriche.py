@@ -0,0 +1,218 @@
+"""Strumentazione leggera degli script: tempi, contatori e byte per fase.
+
+Si attiva con le variabili d'ambiente:
+  METRICHE=1                   raccoglie le metriche e a fine esecuzione aggiunge
+                               una riga JSON a METRICHE_FILE (default metriche.jsonl)
+  METRICHE_PROMETHEUS=<dir>    scrive anche <dir>/scraper_<script>.prom per il
+                               textfile collector di node_exporter
+  METRICHE_PROFILO=cprofile    salva il profilo dell'esecuzione in profilo_<script>.prof
+                               (solo il thread principale: i worker non sono profilati)
+  METRICHE_PROFILO=tracemalloc salva le 25 righe che allocano più memoria in
+                               profilo_<script>_memoria.txt
+
+METRICHE=0 (o vuota) le lascia disattivate, come gli altri flag degli script.
+Disattivate, fase() restituisce un contesto vuoto condiviso, conta() e
+aggiungi_byte() escono subito ed esecuzione() lascia la funzione com'è.
+
+Uso:
+    with metriche.fase('driver_get'):
+        driver.get(url)
+    metriche.aggiungi_byte('pagina', len(response.content))
+"""
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from functools import wraps
+
+# --- CONFIGURAZIONE ---
+METRICHE_FILE = os.environ.get('METRICHE_FILE', 'metriche.jsonl')
+METRICHE_PROMETHEUS = os.environ.get('METRICHE_PROMETHEUS')
+METRICHE_PROFILO = os.environ.get('METRICHE_PROFILO', '').lower()
+ATTIVE = (os.environ.get('METRICHE') or '0') != '0' or bool(METRICHE_PROMETHEUS or METRICHE_PROFILO)
+# --- FINE CONFIGURAZIONE ---
+
+_lock = threading.Lock()
+_fasi = {}
+_contatori = {}
+_esecuzione = {}
+
+
+class _Nessuna:
+    """Contesto che non misura nulla, usato quando le metriche sono disattivate."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *errore):
+        return False
+
+
+_NESSUNA = _Nessuna()
+
+
+class _Fase:
+    __slots__ = ('nome', 'inizio')
+
+    def __init__(self, nome):
+        self.nome = nome
+
+    def __enter__(self):
+        self.inizio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, *errore):
+        durata = time.perf_counter() - self.inizio
+        with _lock:
+            statistiche = _fasi.setdefault(self.nome, {'chiamate': 0, 'errori': 0, 'totale_s': 0.0, 'max_s': 0.0})
+            statistiche['chiamate'] += 1
+            statistiche['totale_s'] += durata
+            statistiche['max_s'] = max(statistiche['max_s'], durata)
+            if tipo is not None:
+                statistiche['errori'] += 1
+        return False
+
+
+def fase(nome):
+    """Contesto che misura la durata di una fase (chiamate, totale, massimo ed errori)."""
+    return _Fase(nome) if ATTIVE else _NESSUNA
+
+
+def conta(nome, quanto=1):
+    """Incrementa un contatore."""
+    if not ATTIVE:
+        return
+    with _lock:
+        _contatori[nome] = _contatori.get(nome, 0) + quanto
+
+
+def imposta(nome, valore):
+    """Imposta un valore puntuale (es. un tempo misurato una volta per esecuzione)."""
+    if not ATTIVE:
+        return
+    with _lock:
+        _contatori[nome] = valore
+
+
+def aggiungi_byte(nome, quanto):
+    """Aggiunge `quanto` byte al contatore <nome>_byte."""
+    if ATTIVE:
+        conta(f"{nome}_byte", quanto)
+
+
+def avvia(script):
+    """Azzera le metriche e, se richiesto, avvia il profilo dell'esecuzione."""
+    with _lock:
+        _fasi.clear()
+        _contatori.clear()
+        _esecuzione.clear()
+        _esecuzione.update({'script': script, 'inizio': time.time(), 'inizio_perf': time.perf_counter()})
+    if METRICHE_PROFILO == 'cprofile':
+        _esecuzione['profilo'] = cProfile.Profile()
+        _esecuzione['profilo'].enable()
+    elif METRICHE_PROFILO == 'tracemalloc':
+        tracemalloc.start(10)
+
+
+def _concludi_profilo(script):
+    if METRICHE_PROFILO == 'cprofile' and _esecuzione.get('profilo'):
+        _esecuzione['profilo'].disable()
+        percorso = f"profilo_{script}.prof"
+        _esecuzione['profilo'].dump_stats(percorso)
+        print(f"📊 Profilo salvato in {percorso} (python -m pstats {percorso})")
+    elif METRICHE_PROFILO == 'tracemalloc' and tracemalloc.is_tracing():
+        istantanea = tracemalloc.take_snapshot()
+        _, picco = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        percorso = f"profilo_{script}_memoria.txt"
+        with open(percorso, 'w', encoding='utf-8') as f:
+            f.write(f"Picco di memoria: {picco / 1024:.0f} KB\n\n")
+            for statistica in istantanea.statistics('lineno')[:25]:
+                f.write(f"{statistica}\n")
+        print(f"📊 Allocazioni principali salvate in {percorso}")
+
+
+def _etichetta(valore):
+    return str(valore).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def _scrivi_prometheus(riepilogo, cartella):
+    """Scrive il file .prom in modo atomico (il collector non deve mai leggerlo a metà)."""
+    script = _etichetta(riepilogo['script'])
+    righe = [
+        '# TYPE scraper_esecuzione_secondi gauge',
+        f'scraper_esecuzione_secondi{{script="{script}"}} {riepilogo["durata_s"]:.6f}',
+        '# TYPE scraper_ultima_esecuzione_timestamp gauge',
+        f'scraper_ultima_esecuzione_timestamp{{script="{script}"}} {riepilogo["inizio"]:.0f}',
+    ]
+    # Le righe di ogni metrica devono essere contigue, dopo la sua riga TYPE
+    for metrica, campo, formato in (('scraper_fase_secondi', 'totale_s', '.6f'),
+                                    ('scraper_fase_secondi_max', 'max_s', '.6f'),
+                                    ('scraper_fase_chiamate', 'chiamate', 'd'),
+                                    ('scraper_fase_errori', 'errori', 'd')):
+        righe.append(f'# TYPE {metrica} gauge')
+        for nome, s in sorted(riepilogo['fasi'].items()):
+            righe.append(f'{metrica}{{script="{script}",fase="{_etichetta(nome)}"}} {s[campo]:{formato}}')
+    righe.append('# TYPE scraper_contatore gauge')
+    for nome, valore in sorted(riepilogo['contatori'].items()):
+        righe.append(f'scraper_contatore{{script="{script}",nome="{_etichetta(nome)}"}} {valore}')
+
+    os.makedirs(cartella, exist_ok=True)
+    percorso = os.path.join(cartella, f"scraper_{riepilogo['script']}.prom")
+    with open(f"{percorso}.tmp", 'w', encoding='utf-8') as f:
+        f.write("\n".join(righe) + "\n")
+    os.replace(f"{percorso}.tmp", percorso)
+
+
+def concludi():
+    """Chiude l'esecuzione: salva la riga JSON, il file Prometheus e l'eventuale profilo.
+
+    Restituisce il riepilogo (None se le metriche sono disattivate).
+    """
+    if not ATTIVE or not _esecuzione:
+        return None
+    script = _esecuzione['script']
+    _concludi_profilo(script)
+    with _lock:
+        riepilogo = {
+            'script': script,
+            'inizio': _esecuzione['inizio'],
+            'durata_s': time.perf_counter() - _esecuzione['inizio_perf'],
+            'fasi': {nome: dict(s) for nome, s in _fasi.items()},
+            'contatori': dict(_contatori),
+        }
+        _esecuzione.clear()
+
+    try:
+        with open(METRICHE_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(riepilogo, ensure_ascii=False) + "\n")
+        if METRICHE_PROMETHEUS:
+            _scrivi_prometheus(riepilogo, METRICHE_PROMETHEUS)
+    except OSError as e:
+        print(f"Errore salvando le metriche: {e}")
+        return riepilogo
+
+    fasi = sorted(riepilogo['fasi'].items(), key=lambda voce: voce[1]['totale_s'], reverse=True)
+    dettaglio = ", ".join(f"{nome} {s['totale_s']:.1f}s/{s['chiamate']}" for nome, s in fasi[:5])
+    print(f"📊 Metriche ({riepilogo['durata_s']:.1f}s): {dettaglio or 'nessuna fase'} -> {METRICHE_FILE}")
+    return riepilogo
+
+
+def esecuzione(script):
+    """Decoratore per la funzione principale di uno script: avvia() prima, concludi() dopo."""
+    def decoratore(funzione):
+        if not ATTIVE:
+            return funzione
+
+        @wraps(funzione)
+        def eseguita(*args, **kwargs):
+            avvia(script)
+            try:
+                return funzione(*args, **kwargs)
+            finally:
+                concludi()
+        return eseguita
+    return decoratore
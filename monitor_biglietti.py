@@ -1,129 +1,418 @@
-import requests
-from bs4 import BeautifulSoup  # <-- RIGA MANCANTE DA AGGIUNGERE
-import os
-import json
-from datetime import datetime
-import time
-
-# --- CONFIGURAZIONE ---
-# Legge i dati esclusivamente dai "Secrets" (variabili d'ambiente)
-TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
-TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID')
-URL = os.environ.get('MONITOR_URL')
-
-JSONBIN_API_KEY = os.environ.get('JSONBIN_API_KEY')
-JSONBIN_ID = os.environ.get('JSONBIN_ID')
-JSONBIN_URL = f"https://api.jsonbin.io/v3/b/{JSONBIN_ID}"
-
-ORE_PER_NOTIFICA_ATTIVA = 8
-# --- FINE CONFIGURAZIONE ---
-
-def leggi_stato_online():
-    """Legge lo stato precedente (dati biglietti e timestamp) da JSONBin.io."""
-    print("--- Leggendo lo stato da JSONBin.io...")
-    headers = {'X-Master-Key': JSONBIN_API_KEY}
-    try:
-        res = requests.get(f"{JSONBIN_URL}/latest", headers=headers, timeout=10)
-        res.raise_for_status()
-        dati = res.json()
-        print("--- Stato letto con successo.")
-        return dati.get('record', {})
-    except Exception as e:
-        print(f"Errore leggendo da JSONBin: {e}")
-        return None
-
-def salva_stato_online(nuovi_dati_biglietti, nuovo_timestamp):
-    """Salva il nuovo stato su JSONBin.io."""
-    print("--- Salvando il nuovo stato su JSONBin.io...")
-    headers = {'Content-Type': 'application/json', 'X-Master-Key': JSONBIN_API_KEY}
-    payload = {"dati_biglietti": nuovi_dati_biglietti, "timestamp_notifica": nuovo_timestamp}
-    try:
-        res = requests.put(JSONBIN_URL, json=payload, headers=headers, timeout=10)
-        res.raise_for_status()
-        print("--- Nuovo stato salvato con successo.")
-    except Exception as e:
-        print(f"Errore salvando su JSONBin: {e}")
-
-def invia_messaggio_telegram(messaggio, url_bottone):
-    """Invia un messaggio con un bottone inline."""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        print("Errore: Token o Chat ID di Telegram non impostati.")
-        return False
-    
-    tastiera = {'inline_keyboard': [[{'text': '➡️ VAI ALLA PAGINA ⬅️', 'url': url_bottone}]]}
-    payload = {'chat_id': TELEGRAM_CHAT_ID, 'text': messaggio, 'parse_mode': 'HTML', 'reply_markup': json.dumps(tastiera)}
-    url_api = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    try:
-        response = requests.post(url_api, data=payload)
-        response.raise_for_status()
-        print("Messaggio inviato con successo a Telegram!")
-        return True
-    except requests.exceptions.RequestException as e:
-        print(f"Errore durante l'invio del messaggio: {e}")
-        return False
-
-def controlla_biglietti():
-    """Estrae i dettagli dei biglietti, li confronta e notifica le variazioni."""
-    if not all([URL, JSONBIN_API_KEY, JSONBIN_ID, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID]):
-        print("Errore: una o più variabili d'ambiente non sono state impostate.")
-        return
-
-    print(f"Avvio controllo biglietti alle {datetime.now().strftime('%H:%M:%S')}...")
-    
-    stato_precedente = leggi_stato_online()
-    if stato_precedente is None:
-        print("Impossibile recuperare lo stato precedente. Riprovo più tardi.")
-        return
-
-    dati_precedenti = stato_precedente.get('dati_biglietti')
-    timestamp_notifica_precedente = float(stato_precedente.get('timestamp_notifica', 0))
-
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        response = requests.get(URL, headers=headers)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        elementi_biglietti = soup.find_all('div', class_='ticket-info showing')
-        
-        lista_dettagli = []
-        if not elementi_biglietti:
-            dati_attuali = "Nessun biglietto disponibile."
-        else:
-            for ticket in elementi_biglietti:
-                orario_el = ticket.find('div', class_='col-20 block time')
-                tratta_el = ticket.find('div', class_='col-30 block mobile-pl tra_stat_title')
-                prezzo_el = ticket.find('div', class_='col-16 block mob-right')
-                orario = " ".join(orario_el.text.strip().split()) if orario_el else "N/D"
-                tratta = " ".join(tratta_el.text.strip().split()) if tratta_el else "N/D"
-                prezzo = " ".join(prezzo_el.text.strip().split()) if prezzo_el else "N/D"
-                lista_dettagli.append(f"• {orario} | {tratta} | <b>{prezzo}</b>")
-            dati_attuali = "\n".join(lista_dettagli)
-        
-        orario_controllo = datetime.now().strftime("%H:%M del %d/%m/%Y")
-        
-        notifica_da_inviare = False
-        messaggio = ""
-
-        if dati_precedenti == "stato_iniziale" or dati_precedenti is None:
-            messaggio = f"✅ <b>Monitoraggio avviato</b>\n<i>Controllo delle {orario_controllo}</i>\n\n<b>Biglietti trovati:</b>\n{dati_attuali}"
-            notifica_da_inviare = True
-        elif dati_attuali != dati_precedenti:
-            messaggio = f"❗️<b>Variazione Rilevata!</b>❗️\n<i>Controllo delle {orario_controllo}</i>\n\n<b>Nuovi dati:</b>\n{dati_attuali}"
-            notifica_da_inviare = True
-        else:
-            print("Nessuna variazione rilevata.")
-            if (time.time() - timestamp_notifica_precedente) > (ORE_PER_NOTIFICA_ATTIVA * 3600):
-                messaggio = f"✅ <b>Monitoraggio attivo</b>\n<i>Nessuna variazione da >{ORE_PER_NOTIFICA_ATTIVA} ore (controllo delle {orario_controllo})</i>\n\n<b>Stato attuale:</b>\n{dati_attuali}"
-                notifica_da_inviare = True
-
-        if notifica_da_inviare:
-            if invia_messaggio_telegram(messaggio, URL):
-                salva_stato_online(dati_attuali, time.time())
-
-    except Exception as e:
-        print(f"Si è verificato un errore critico: {e}")
-        invia_messaggio_telegram(f"☠️ Errore nello script alle {datetime.now().strftime('%H:%M')}:\n<pre>{e}</pre>", URL)
-
-if __name__ == '__main__':
-    controlla_biglietti()
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+import hashlib
+from html import escape
+import os
+import re
+from datetime import datetime
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+import metriche
+import notifiche_telegram
+from archivio_stato import STATO_BACKEND, crea_archivio
+
+# Motori di parsing più veloci, usati solo se installati
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser as SelectolaxParser
+    except ImportError:
+        SelectolaxParser = None
+
+# --- CONFIGURAZIONE ---
+# Legge i dati esclusivamente dai "Secrets" (variabili d'ambiente)
+TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
+TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID')
+URL = os.environ.get('MONITOR_URL')
+
+# Lo stato è salvato nell'archivio scelto con STATO_BACKEND (default: JSONBin.io)
+JSONBIN_API_KEY = os.environ.get('JSONBIN_API_KEY')
+JSONBIN_ID = os.environ.get('JSONBIN_ID')
+ARCHIVIO = crea_archivio('monitor_biglietti')
+
+ORE_PER_NOTIFICA_ATTIVA = 8
+
+# Modalità watchlist: file con un URL per riga al posto del singolo MONITOR_URL
+WATCHLIST = os.environ.get('MONITOR_WATCHLIST')
+MAX_THREAD = int(os.environ.get('MONITOR_MAX_THREAD', '32'))
+MAX_RICHIESTE_PER_HOST = int(os.environ.get('MONITOR_MAX_PER_HOST', '4'))
+
+# Sessione riutilizzata tra un controllo e l'altro (utile quando lo script gira come demone)
+SESSIONE = requests.Session()
+
+# Classe che identifica ogni biglietto nella pagina
+MARCATORE_BIGLIETTO = 'ticket-info showing'
+
+# Classi (attributo class completo) dei blocchi letti dalla pagina
+CLASSI = {
+    'biglietto': 'ticket-info showing',
+    'orario': 'col-20 block time',
+    'tratta': 'col-30 block mobile-pl tra_stat_title',
+    'prezzo': 'col-16 block mob-right',
+}
+# Con lxml installato anche BeautifulSoup lo usa come parser
+PARSER_SOUP = 'lxml' if lxml is not None else 'html.parser'
+# --- FINE CONFIGURAZIONE ---
+
+_TAG_DIV = re.compile(r'<(/?)div\b', re.IGNORECASE)
+
+def impronta_biglietti(html):
+    """Calcola un'impronta della sola sezione dei biglietti, senza fare il parsing della pagina.
+
+    La sezione va dal primo biglietto al </div> che chiude l'ultimo, trovato
+    contando i <div> annidati; il resto della pagina (script, token, banner)
+    non influisce sull'impronta. Se l'ultimo biglietto non è chiuso (pagina
+    troncata) la sezione arriva fino alla fine della pagina.
+    """
+    inizio = html.find(MARCATORE_BIGLIETTO)
+    if inizio == -1:
+        return "nessun-biglietto"
+    # Apertura del <div> dell'ultimo biglietto
+    ultimo = html.rfind('<', 0, html.rfind(MARCATORE_BIGLIETTO))
+    fine = len(html)
+    profondita = 0
+    for tag in _TAG_DIV.finditer(html, ultimo):
+        profondita += -1 if tag.group(1) else 1
+        if profondita == 0:
+            fine = tag.end()
+            break
+    return hashlib.blake2b(html[inizio:fine].encode('utf-8'), digest_size=16).hexdigest()
+
+def _testo(testo):
+    return " ".join(testo.strip().split())
+
+def _estrai_con_soup(html, solo_biglietti=True):
+    """Estrazione con BeautifulSoup; con solo_biglietti costruisce l'albero dei soli biglietti."""
+    if solo_biglietti:
+        soup = BeautifulSoup(html, PARSER_SOUP, parse_only=SoupStrainer('div', class_=CLASSI['biglietto']))
+    else:
+        soup = BeautifulSoup(html, 'html.parser')
+    biglietti = []
+    for ticket in soup.find_all('div', class_=CLASSI['biglietto']):
+        campi = {}
+        for campo in ('orario', 'tratta', 'prezzo'):
+            elemento = ticket.find('div', class_=CLASSI[campo])
+            campi[campo] = _testo(elemento.text) if elemento else "N/D"
+        biglietti.append(campi)
+    return biglietti
+
+def _estrai_con_lxml(html):
+    albero = lxml.html.fromstring(html)
+    biglietti = []
+    for ticket in albero.xpath(f"//div[@class='{CLASSI['biglietto']}']"):
+        campi = {}
+        for campo in ('orario', 'tratta', 'prezzo'):
+            elementi = ticket.xpath(f".//div[@class='{CLASSI[campo]}']")
+            campi[campo] = _testo(elementi[0].text_content()) if elementi else "N/D"
+        biglietti.append(campi)
+    return biglietti
+
+def _estrai_con_selectolax(html):
+    albero = SelectolaxParser(html)
+    biglietti = []
+    for ticket in albero.css(f'div[class="{CLASSI["biglietto"]}"]'):
+        campi = {}
+        for campo in ('orario', 'tratta', 'prezzo'):
+            elemento = ticket.css_first(f'div[class="{CLASSI[campo]}"]')
+            campi[campo] = _testo(elemento.text()) if elemento is not None else "N/D"
+        biglietti.append(campi)
+    return biglietti
+
+STRATEGIE_PARSING = {
+    'soup': lambda html: _estrai_con_soup(html, solo_biglietti=False),
+    'strainer': _estrai_con_soup,
+}
+if lxml is not None:
+    STRATEGIE_PARSING['lxml'] = _estrai_con_lxml
+if SelectolaxParser is not None:
+    STRATEGIE_PARSING['selectolax'] = _estrai_con_selectolax
+
+def strategia_predefinita():
+    """La strategia più veloce tra quelle disponibili, se non impostata con MONITOR_PARSER."""
+    richiesta = os.environ.get('MONITOR_PARSER', 'auto')
+    if richiesta in STRATEGIE_PARSING:
+        return richiesta
+    for nome in ('selectolax', 'lxml', 'strainer'):
+        if nome in STRATEGIE_PARSING:
+            return nome
+
+def estrai_biglietti(html, strategia=None):
+    """Estrae dalla pagina l'elenco dei biglietti come dizionari (orario, tratta, prezzo).
+
+    Tutte le strategie producono gli stessi record (vedi benchmark.py e le
+    pagine salvate in fixtures/biglietti).
+    """
+    return STRATEGIE_PARSING[strategia or strategia_predefinita()](html)
+
+def formatta_biglietti(biglietti):
+    """Testo HTML dei biglietti usato nei messaggi Telegram."""
+    if not biglietti:
+        return "Nessun biglietto disponibile."
+    return "\n".join(f"• {b['orario']} | {b['tratta']} | <b>{b['prezzo']}</b>" for b in biglietti)
+
+def invia_messaggio_telegram(messaggio, url_bottone=None):
+    """Invia un messaggio, con un bottone inline se è indicato un URL."""
+    if url_bottone:
+        tastiera = {'inline_keyboard': [[{'text': '➡️ VAI ALLA PAGINA ⬅️', 'url': url_bottone}]]}
+        inviato = notifiche_telegram.invia(messaggio, 'HTML', reply_markup=tastiera,
+                                           token=TELEGRAM_BOT_TOKEN, chat_id=TELEGRAM_CHAT_ID)
+    else:
+        inviato = notifiche_telegram.invia(messaggio, 'HTML', disable_web_page_preview=True,
+                                           token=TELEGRAM_BOT_TOKEN, chat_id=TELEGRAM_CHAT_ID)
+    if inviato:
+        print("Messaggio inviato con successo a Telegram!")
+    return inviato
+
+def scarica_biglietti(stato_precedente, url=None, session=None):
+    """Scarica la pagina solo se è cambiata e restituisce (biglietti, metadati HTTP e impronta).
+
+    Invia If-None-Match/If-Modified-Since con i valori del controllo precedente:
+    con una risposta 304, o con un'impronta della sezione biglietti identica,
+    riusa i biglietti salvati senza fare il parsing della pagina.
+    """
+    biglietti_precedenti = stato_precedente.get('biglietti')
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+    if biglietti_precedenti is not None:
+        if stato_precedente.get('etag'):
+            headers['If-None-Match'] = stato_precedente['etag']
+        if stato_precedente.get('last_modified'):
+            headers['If-Modified-Since'] = stato_precedente['last_modified']
+
+    with metriche.fase('download_pagina'):
+        response = (session or SESSIONE).get(url or URL, headers=headers, timeout=30)
+    metriche.aggiungi_byte('pagina', len(response.content))
+    if response.status_code == 304:
+        print(f"Pagina non modificata (304): {url or URL}")
+        metriche.conta('pagine_304')
+        return biglietti_precedenti, {
+            'etag': stato_precedente.get('etag'),
+            'last_modified': stato_precedente.get('last_modified'),
+            'impronta': stato_precedente.get('impronta'),
+        }
+    response.raise_for_status()
+
+    meta = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'impronta': impronta_biglietti(response.text),
+    }
+    if biglietti_precedenti is not None and meta['impronta'] == stato_precedente.get('impronta'):
+        print(f"Sezione biglietti invariata (stessa impronta): {url or URL}")
+        metriche.conta('impronte_invariate')
+        return biglietti_precedenti, meta
+    with metriche.fase('parsing'):
+        return estrai_biglietti(response.text), meta
+
+def esito_controllo(stato_precedente, biglietti):
+    """Confronta i biglietti con lo stato salvato.
+
+    Restituisce 'avviato' (nessuno stato precedente), 'variazione',
+    'attivo' (nessuna variazione da più di ORE_PER_NOTIFICA_ATTIVA ore) o None.
+    """
+    if stato_precedente.get('biglietti') is not None:
+        dati_precedenti = formatta_biglietti(stato_precedente['biglietti'])
+    else:
+        # Stato salvato dalle versioni precedenti: solo il testo già formattato
+        dati_precedenti = stato_precedente.get('dati_biglietti')
+
+    if dati_precedenti == "stato_iniziale" or dati_precedenti is None:
+        return 'avviato'
+    if formatta_biglietti(biglietti) != dati_precedenti:
+        return 'variazione'
+    if (time.time() - float(stato_precedente.get('timestamp_notifica', 0))) > (ORE_PER_NOTIFICA_ATTIVA * 3600):
+        return 'attivo'
+    return None
+
+def stato_modificato(stato_precedente, meta):
+    """Indica se impronta o validatori HTTP sono cambiati rispetto allo stato salvato.
+
+    Anche senza notifica conviene salvarli: il prossimo controllo potrà
+    evitare il parsing.
+    """
+    return any(stato_precedente.get(k) != v for k, v in meta.items()) or 'biglietti' not in stato_precedente
+
+def controlla_biglietti():
+    """Estrae i dettagli dei biglietti, li confronta e notifica le variazioni.
+
+    Restituisce True se è stata rilevata una variazione (o il primo avvio).
+    """
+    richieste = [URL, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID]
+    if 'jsonbin' in STATO_BACKEND:
+        richieste += [JSONBIN_API_KEY, JSONBIN_ID]
+    if not all(richieste):
+        print("Errore: una o più variabili d'ambiente non sono state impostate.")
+        return False
+
+    print(f"Avvio controllo biglietti alle {datetime.now().strftime('%H:%M:%S')}...")
+    
+    stato_precedente = ARCHIVIO.leggi()
+    if stato_precedente is None:
+        print("Impossibile recuperare lo stato precedente. Riprovo più tardi.")
+        return False
+
+    timestamp_notifica_precedente = float(stato_precedente.get('timestamp_notifica', 0))
+
+    try:
+        biglietti, meta = scarica_biglietti(stato_precedente)
+        dati_attuali = formatta_biglietti(biglietti)
+        
+        orario_controllo = datetime.now().strftime("%H:%M del %d/%m/%Y")
+        
+        esito = esito_controllo(stato_precedente, biglietti)
+        messaggio = ""
+
+        if esito == 'avviato':
+            messaggio = f"✅ <b>Monitoraggio avviato</b>\n<i>Controllo delle {orario_controllo}</i>\n\n<b>Biglietti trovati:</b>\n{dati_attuali}"
+        elif esito == 'variazione':
+            messaggio = f"❗️<b>Variazione Rilevata!</b>❗️\n<i>Controllo delle {orario_controllo}</i>\n\n<b>Nuovi dati:</b>\n{dati_attuali}"
+        else:
+            print("Nessuna variazione rilevata.")
+            if esito == 'attivo':
+                messaggio = f"✅ <b>Monitoraggio attivo</b>\n<i>Nessuna variazione da >{ORE_PER_NOTIFICA_ATTIVA} ore (controllo delle {orario_controllo})</i>\n\n<b>Stato attuale:</b>\n{dati_attuali}"
+
+        nuovo_stato = {'biglietti': biglietti, 'timestamp_notifica': timestamp_notifica_precedente, **meta}
+        if esito:
+            if invia_messaggio_telegram(messaggio, URL):
+                nuovo_stato['timestamp_notifica'] = time.time()
+                ARCHIVIO.scrivi(nuovo_stato)
+        elif stato_modificato(stato_precedente, meta):
+            ARCHIVIO.scrivi(nuovo_stato)
+        return esito in ('avviato', 'variazione')
+
+    except Exception as e:
+        print(f"Si è verificato un errore critico: {e}")
+        invia_messaggio_telegram(f"☠️ Errore nello script alle {datetime.now().strftime('%H:%M')}:\n<pre>{e}</pre>", URL)
+        return False
+    finally:
+        ARCHIVIO.flush()
+
+# --- MODALITÀ WATCHLIST (molte pagine) ---
+
+_semafori_host = {}
+_semafori_lock = threading.Lock()
+
+def semaforo_host(url):
+    """Semaforo che limita a MAX_RICHIESTE_PER_HOST le richieste contemporanee verso lo stesso host."""
+    host = urllib.parse.urlsplit(url).netloc
+    with _semafori_lock:
+        if host not in _semafori_host:
+            _semafori_host[host] = threading.BoundedSemaphore(MAX_RICHIESTE_PER_HOST)
+        return _semafori_host[host]
+
+def crea_sessione():
+    """Sessione HTTP con un pool di connessioni keep-alive condiviso tra i thread."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=MAX_THREAD, pool_maxsize=MAX_RICHIESTE_PER_HOST)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def carica_watchlist(percorso):
+    """Legge gli URL da controllare (uno per riga, le righe che iniziano con # sono ignorate)."""
+    with open(percorso, encoding='utf-8') as f:
+        return list(dict.fromkeys(riga.strip() for riga in f if riga.strip() and not riga.startswith('#')))
+
+def controlla_pagina(url, stato_pagina, session):
+    """Controlla una pagina della watchlist e restituisce (url, biglietti, meta, esito, errore)."""
+    try:
+        with semaforo_host(url):
+            biglietti, meta = scarica_biglietti(stato_pagina, url, session)
+        return url, biglietti, meta, esito_controllo(stato_pagina, biglietti), None
+    except Exception as e:
+        print(f"Errore controllando {url}: {e}")
+        return url, None, None, None, e
+
+def controlla_watchlist(percorso=None):
+    """Controlla in parallelo tutte le pagine della watchlist e notifica le variazioni in un unico riepilogo.
+
+    Lo stato di ogni pagina è salvato sotto la chiave 'pagine' dell'archivio,
+    indicizzato per URL. Restituisce True se almeno una pagina è cambiata.
+    """
+    percorso = percorso or WATCHLIST
+    print(f"Avvio controllo watchlist alle {datetime.now().strftime('%H:%M:%S')}...")
+
+    stato = ARCHIVIO.leggi()
+    if stato is None:
+        print("Impossibile recuperare lo stato precedente. Riprovo più tardi.")
+        return False
+
+    pagine = stato.get('pagine', {})
+    urls = carica_watchlist(percorso)
+    session = crea_sessione()
+    inizio = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_THREAD) as executor:
+            risultati = list(executor.map(lambda url: controlla_pagina(url, pagine.get(url, {}), session), urls))
+        print(f"Controllate {len(urls)} pagine in {time.monotonic() - inizio:.1f}s.")
+
+        orario_controllo = datetime.now().strftime("%H:%M del %d/%m/%Y")
+        titoli = {'avviato': "✅ <b>Monitoraggio avviato</b>", 'variazione': "❗️<b>Variazione Rilevata!</b>❗️"}
+        sezioni, attive, errori = [], [], []
+        nuove_pagine = {}
+        da_notificare = []
+        for url, biglietti, meta, esito, errore in risultati:
+            if errore is not None:
+                errori.append(f"• {url}: <code>{escape(str(errore))}</code>")
+                if url in pagine:
+                    nuove_pagine[url] = pagine[url]
+                continue
+            precedente = pagine.get(url, {})
+            nuove_pagine[url] = {'biglietti': biglietti,
+                                 'timestamp_notifica': float(precedente.get('timestamp_notifica', 0)), **meta}
+            if esito in titoli:
+                sezioni.append((f"{titoli[esito]} — <a href=\"{url}\">{url}</a>\n{formatta_biglietti(biglietti)}",
+                                url, None))
+                da_notificare.append(url)
+            elif esito == 'attivo':
+                attive.append((f"• <a href=\"{url}\">{url}</a>: {len(biglietti)} biglietti", url))
+                da_notificare.append(url)
+
+        # Voci del riepilogo come (testo, URL, separatore dalla voce precedente)
+        if attive:
+            sezioni.append((f"✅ <b>Nessuna variazione da >{ORE_PER_NOTIFICA_ATTIVA} ore</b>", None, None))
+            sezioni.extend((riga, url, "\n") for riga, url in attive)
+        if errori:
+            sezioni.append(("☠️ <b>Pagine non controllate</b>\n" + "\n".join(errori), None, None))
+
+        # La coda divide il riepilogo solo tra una riga e l'altra, così nessun tag HTML resta aperto
+        coda = notifiche_telegram.CodaTelegram('HTML', disable_web_page_preview=True,
+                                               token=TELEGRAM_BOT_TOKEN, chat_id=TELEGRAM_CHAT_ID)
+        if sezioni:
+            testo, url, separatore = sezioni[0]
+            sezioni[0] = (f"<b>Watchlist biglietti</b> — <i>controllo delle {orario_controllo}</i>\n\n{testo}",
+                          url, separatore)
+        for testo, url, separatore in sezioni:
+            coda.accoda(testo, chiave=url, separatore=separatore)
+        coda.svuota()
+        for url in da_notificare:
+            if url not in coda.non_consegnati:
+                nuove_pagine[url]['timestamp_notifica'] = time.time()
+            # Notifica non riuscita: la pagina mantiene lo stato precedente e viene notificata di nuovo
+            elif url in pagine:
+                nuove_pagine[url] = pagine[url]
+            else:
+                del nuove_pagine[url]
+
+        if nuove_pagine != pagine:
+            ARCHIVIO.scrivi({**stato, 'pagine': nuove_pagine})
+        return any(esito in titoli for _, _, _, esito, _ in risultati)
+    finally:
+        session.close()
+        ARCHIVIO.flush()
+
+@metriche.esecuzione('monitor_biglietti')
+def esegui_controllo():
+    """Esegue il controllo nella modalità configurata (watchlist o singola pagina)."""
+    return controlla_watchlist() if WATCHLIST else controlla_biglietti()
+
+if __name__ == '__main__':
+    esegui_controllo()
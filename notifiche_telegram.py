@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metriche
+
+# --- CONFIGURAZIONE ---
+# Base della Bot API; può puntare a un server locale (vedi server_simulato.rotte_telegram)
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+LIMITE_CARATTERI = 4096
+TIMEOUT = 15
+MAX_TENTATIVI = 5
+# Attesa massima accettata per un retry_after, oltre la quale il messaggio viene scartato
+MAX_ATTESA_RETRY = 120
+# --- FINE CONFIGURAZIONE ---
+
+_sessione = None
+_sessione_lock = threading.Lock()
+
+
+def sessione():
+    """Sessione keep-alive condivisa per tutte le chiamate alla Bot API."""
+    global _sessione
+    with _sessione_lock:
+        if _sessione is None:
+            _sessione = requests.Session()
+            _sessione.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            _sessione.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        return _sessione
+
+
+def dividi_testo(testo, limite=LIMITE_CARATTERI):
+    """Divide un testo in parti di al massimo `limite` caratteri.
+
+    Taglia preferibilmente tra paragrafi, poi tra righe; solo una riga più
+    lunga del limite viene spezzata a metà.
+    """
+    if len(testo) <= limite:
+        return [testo]
+
+    parti = []
+    corrente = ""
+    for riga in testo.split("\n"):
+        while len(riga) > limite:
+            if corrente:
+                parti.append(corrente)
+                corrente = ""
+            parti.append(riga[:limite])
+            riga = riga[limite:]
+        candidato = f"{corrente}\n{riga}" if corrente else riga
+        if len(candidato) > limite:
+            parti.append(corrente)
+            corrente = riga
+        else:
+            corrente = candidato
+    if corrente:
+        parti.append(corrente)
+    return [parte for parte in parti if parte.strip()]
+
+
+def _invia_parte(url, payload):
+    """Invia una singola parte rispettando i 429 (retry_after) e riprovando sugli errori temporanei."""
+    for tentativo in range(MAX_TENTATIVI):
+        try:
+            with metriche.fase('telegram'):
+                res = sessione().post(url, json=payload, timeout=TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            print(f"Errore di connessione a Telegram: {e}")
+            time.sleep(min(2 ** tentativo, 30))
+            continue
+
+        if res.status_code == 429:
+            metriche.conta('telegram_429')
+            try:
+                attesa = float(res.json().get('parameters', {}).get('retry_after', 1))
+            except ValueError:
+                attesa = 1.0
+            if attesa > MAX_ATTESA_RETRY:
+                print(f"Telegram chiede di attendere {attesa:.0f}s: messaggio non inviato.")
+                return False
+            print(f"Telegram: troppe richieste, riprovo tra {attesa:.0f}s.")
+            time.sleep(attesa)
+            continue
+        if res.status_code >= 500:
+            time.sleep(min(2 ** tentativo, 30))
+            continue
+        if res.ok:
+            metriche.conta('telegram_messaggi')
+            metriche.aggiungi_byte('telegram', len(payload['text'].encode('utf-8')))
+            return True
+        print(f"Errore nell'invio del messaggio a Telegram: {res.status_code} - {res.text}")
+        return False
+    return False
+
+
+def invia(testo, parse_mode='HTML', reply_markup=None, disable_web_page_preview=None,
+          token=None, chat_id=None):
+    """Invia un messaggio, diviso in più parti se supera il limite di Telegram.
+
+    Token e chat sono letti da TELEGRAM_BOT_TOKEN e TELEGRAM_CHAT_ID se non
+    indicati. L'eventuale tastiera inline viene allegata all'ultima parte.
+    Restituisce True se tutte le parti sono state inviate.
+    """
+    token = token or os.environ.get('TELEGRAM_BOT_TOKEN')
+    chat_id = chat_id or os.environ.get('TELEGRAM_CHAT_ID')
+    if not token or not chat_id:
+        print("Errore: Token o Chat ID di Telegram non impostati.")
+        return False
+
+    url = f"{TELEGRAM_API_URL}/bot{token}/sendMessage"
+    parti = dividi_testo(testo)
+    for numero, parte in enumerate(parti, start=1):
+        payload = {'chat_id': chat_id, 'text': parte}
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+        if disable_web_page_preview is not None:
+            payload['disable_web_page_preview'] = disable_web_page_preview
+        if reply_markup and numero == len(parti):
+            payload['reply_markup'] = reply_markup
+        if not _invia_parte(url, payload):
+            return False
+    return True
+
+
+class CodaTelegram:
+    """Coda di messaggi da inviare insieme.
+
+    I messaggi accodati vengono uniti in blocchi sotto il limite di
+    caratteri, così molti avvisi brevi diventano pochi messaggi Telegram.
+    Un messaggio può essere accodato con una `chiave` (es. l'URL o la data
+    a cui si riferisce): dopo svuota(), `non_consegnati` contiene le chiavi
+    dei messaggi finiti in almeno un blocco non inviato. Con `separatore`
+    un messaggio si unisce al precedente con un testo diverso dal solito,
+    ad esempio "\n" per le righe di un elenco.
+    """
+
+    def __init__(self, parse_mode='HTML', separatore="\n\n", **opzioni):
+        self.parse_mode = parse_mode
+        self.separatore = separatore
+        self.opzioni = opzioni
+        self.messaggi = []
+        self.non_consegnati = set()
+
+    def accoda(self, testo, chiave=None, separatore=None):
+        self.messaggi.append((testo, chiave, self.separatore if separatore is None else separatore))
+
+    def blocchi(self):
+        """Restituisce i blocchi da inviare come lista di (testo, chiavi dei messaggi contenuti)."""
+        blocchi = []
+        corrente, chiavi = "", set()
+        for messaggio, chiave, separatore in self.messaggi:
+            for parte in dividi_testo(messaggio):
+                candidato = f"{corrente}{separatore}{parte}" if corrente else parte
+                if len(candidato) > LIMITE_CARATTERI:
+                    blocchi.append((corrente, chiavi))
+                    corrente, chiavi = parte, set()
+                else:
+                    corrente = candidato
+                if chiave is not None:
+                    chiavi.add(chiave)
+        if corrente:
+            blocchi.append((corrente, chiavi))
+        return blocchi
+
+    def svuota(self):
+        """Invia i messaggi accodati. Restituisce True se sono stati tutti inviati."""
+        blocchi = self.blocchi()
+        self.messaggi = []
+        self.non_consegnati = set()
+        inviati = 0
+        for blocco, chiavi in blocchi:
+            if invia(blocco, parse_mode=self.parse_mode, **self.opzioni):
+                inviati += 1
+            else:
+                self.non_consegnati |= chiavi
+        if blocchi:
+            print(f"Telegram: {inviati}/{len(blocchi)} messaggi inviati.")
+        return inviati == len(blocchi)
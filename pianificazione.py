@@ -0,0 +1,67 @@
+import os
+import time
+from datetime import datetime
+
+# --- CONFIGURAZIONE ---
+# Budget per esecuzione di cerca_treni: numero massimo di ricerche e/o secondi
+# dedicati alle ricerche (non impostati = tutte le date da ricontrollare)
+BUDGET_REQUESTS = int(os.environ.get('CERCA_TRENI_BUDGET_REQUESTS') or 0) or None
+BUDGET_SECONDS = float(os.environ.get('CERCA_TRENI_BUDGET_SECONDS') or 0) or None
+# Una data a questa distanza vale la metà di una data imminente
+PROXIMITY_HALF_LIFE_DAYS = 30
+# Peso della volatilità, misurata come variazione relativa media tra due
+# rilevazioni consecutive dello stesso treno negli ultimi VOLATILITY_LOOKBACK_DAYS giorni
+VOLATILITY_WEIGHT = 10.0
+VOLATILITY_LOOKBACK_DAYS = 14
+# Ore di arretrato attribuite a una data mai controllata
+NEVER_CHECKED_HOURS = 30 * 24
+# Con un budget, le date controllate da meno di così non vengono riproposte
+MIN_RECHECK_SECONDS = 6 * 3600
+# --- FINE CONFIGURAZIONE ---
+
+
+def route_key(search):
+    """Chiave della tratta usata nello storico dei prezzi."""
+    return f"{search['departure_station']} -> {search['arrival_station']}"
+
+
+def priority(days_ahead, volatility, hours_since_check):
+    """Valore di un controllo: cresce con il tempo dall'ultimo controllo e con la
+    volatilità dei prezzi, e si dimezza ogni PROXIMITY_HALF_LIFE_DAYS giorni di distanza."""
+    proximity = 0.5 ** (max(0, days_ahead) / PROXIMITY_HALF_LIFE_DAYS)
+    return hours_since_check * proximity * (1 + VOLATILITY_WEIGHT * volatility)
+
+
+def plan_searches(candidates, cache, history, budget_requests=BUDGET_REQUESTS, now=None):
+    """Sceglie quali (ricerca, data) controllare e in che ordine.
+
+    `candidates` è una lista di (ricerca, lista di date 'dd-mm-YYYY').
+    Senza budget restituisce le date che la cache considera da ricontrollare;
+    con un budget le migliori `budget_requests` tra quelle non controllate
+    nelle ultime MIN_RECHECK_SECONDS. In entrambi i casi in ordine di
+    priorità decrescente. Restituisce (lista di (priorità, ricerca, data), date rimandate).
+    """
+    now = now or time.time()
+    today = datetime.fromtimestamp(now)
+    since = now - VOLATILITY_LOOKBACK_DAYS * 86400
+    scored = []
+    total = 0
+    for search, dates in candidates:
+        checked = cache.check_times(search)
+        volatility = history.volatility_by_date(route_key(search), since)
+        for date in dates:
+            total += 1
+            last_checked = checked.get(date)
+            if budget_requests is None:
+                if not cache.is_due(search, date, now):
+                    continue
+            elif last_checked is not None and now - last_checked < MIN_RECHECK_SECONDS:
+                continue
+            hours = NEVER_CHECKED_HOURS if last_checked is None else (now - last_checked) / 3600
+            days_ahead = (datetime.strptime(date, '%d-%m-%Y') - today).days
+            scored.append((priority(days_ahead, volatility.get(date, 0.0), hours), search, date))
+
+    scored.sort(key=lambda item: item[0], reverse=True)
+    if budget_requests is not None:
+        scored = scored[:budget_requests]
+    return scored, total - len(scored)
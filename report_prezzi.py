@@ -2,8 +2,13 @@ import requests
 import os
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+import metriche
+import notifiche_telegram
+from storico_turni import StoricoTurni
+
 # ==========================================
 #            CONFIGURAZIONE
 # ==========================================
@@ -15,107 +20,271 @@ DATE_DA_CONTROLLARE = ["27/11/2026", "28/11/2026"]
 PICKUP_RICHIESTO = "08:30"
 EXCURSION_ID = "1"
 
+API_SHIFTS = os.environ.get('HYA_API_URL', "https://api.hieloyaventura.com/api/hya") + "/shifts"
+# Campi in cui cercare la data di ogni turno nelle risposte su più giorni
+CAMPI_DATA_TURNO = ("FECHA", "FECHA_TURNO", "DATE", "DIA")
+# Pianificazione dei download: intervalli vicini vengono uniti in un'unica chiamata
+MAX_BUCO_GIORNI = 30
+MAX_GIORNI_PER_CHIAMATA = 240
+
+# File JSON con più escursioni/pickup/date da controllare (vedi carica_watchlist)
+WATCHLIST = os.environ.get('HYA_WATCHLIST')
+MAX_ESCURSIONI_PARALLELE = 8
+
 FILE_STATO = "stato.json"
 DIR_STORICO = "storico"
 
+# Sessione HTTP riutilizzata tra le chiamate (e tra i giri quando lo script gira come demone)
+SESSIONE = requests.Session()
+SESSIONE.headers.update({'User-Agent': 'Mozilla/5.0'})
+
 # ==========================================
 #               FUNZIONI
 # ==========================================
 
 def invia_telegram(testo):
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        print(" [!] Errore: Token o Chat ID mancanti.")
-        return
-
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {
-        'chat_id': TELEGRAM_CHAT_ID, 
-        'text': testo,
-        'parse_mode': 'HTML',
-        'disable_web_page_preview': True
-    }
-    
+    # I report con molte escursioni vengono divisi in più messaggi da notifiche_telegram
+    if notifiche_telegram.invia(testo, 'HTML', disable_web_page_preview=True,
+                                token=TELEGRAM_BOT_TOKEN, chat_id=TELEGRAM_CHAT_ID):
+        print(" [v] Notifica Telegram inviata con successo.")
+    else:
+        print(" [X] Notifica Telegram non inviata.")
+
+def scarica_turni(data_da, data_a, excursion_id=EXCURSION_ID):
+    """Scarica i turni tra due date (incluse). Restituisce il JSON della risposta o None."""
+    date_from = data_da.strftime("%d/%m/%Y")
+    date_to = data_a.strftime("%d/%m/%Y")
+    url = f"{API_SHIFTS}?date_from={date_from}&date_to={date_to}&excursion_id={excursion_id}"
+    print(f"--- Download turni escursione {excursion_id} ({date_from} - {date_to}) ---")
+
     try:
-        response = requests.post(url, data=payload, timeout=10)
-        if response.status_code == 200:
-            print(" [v] Notifica Telegram inviata con successo.")
-        else:
-            print(f" [X] Errore Telegram: {response.text}")
+        with metriche.fase('download_turni'):
+            resp = SESSIONE.get(url, timeout=30)
+        metriche.aggiungi_byte('turni', len(resp.content))
+        if resp.status_code == 200:
+            return resp.json()
+        print(f" [X] Errore API turni: {resp.status_code}")
     except Exception as e:
-        print(f" [!] Errore connessione Telegram: {e}")
+        print(f" [!] Errore download turni: {e}")
+    return None
 
-def salva_storico_6_mesi():
-    """Scarica il JSON da oggi a +6 mesi e lo salva nella cartella storico/"""
-    os.makedirs(DIR_STORICO, exist_ok=True)
-    
-    oggi = datetime.now()
-    tra_6_mesi = oggi + timedelta(days=180)
-    
-    date_from = oggi.strftime("%d/%m/%Y")
-    date_to = tra_6_mesi.strftime("%d/%m/%Y")
-    
-    url = f"https://api.hieloyaventura.com/api/hya/shifts?date_from={date_from}&date_to={date_to}&excursion_id={EXCURSION_ID}"
-    print(f"--- Salvataggio storico ({date_from} - {date_to}) ---")
-    
+def pianifica_intervalli(date_richieste, intervalli_fissi=()):
+    """Unisce date e intervalli da scaricare nel minor numero di chiamate.
+
+    Due intervalli vengono uniti se distano al massimo MAX_BUCO_GIORNI giorni
+    e l'intervallo risultante non supera MAX_GIORNI_PER_CHIAMATA.
+    """
+    intervalli = sorted([(d, d) for d in date_richieste] + list(intervalli_fissi))
+    uniti = []
+    for inizio, fine in intervalli:
+        if uniti:
+            ultimo_inizio, ultima_fine = uniti[-1]
+            nuova_fine = max(fine, ultima_fine)
+            if (inizio - ultima_fine).days <= MAX_BUCO_GIORNI and (nuova_fine - ultimo_inizio).days <= MAX_GIORNI_PER_CHIAMATA:
+                uniti[-1] = (ultimo_inizio, nuova_fine)
+                continue
+        uniti.append((inizio, fine))
+    return uniti
+
+def data_turno(turno):
+    """Data del turno letta dai campi CAMPI_DATA_TURNO, o None se non presente."""
+    for campo in CAMPI_DATA_TURNO:
+        valore = turno.get(campo)
+        if not valore:
+            continue
+        for formato in ("%d/%m/%Y", "%Y-%m-%d"):
+            try:
+                return datetime.strptime(str(valore)[:10], formato).date()
+            except ValueError:
+                continue
+    return None
+
+def indicizza_turni_per_data(turni):
+    """Raggruppa i turni per data. Restituisce None se qualche turno non ha una data riconoscibile."""
+    per_data = {}
+    for turno in turni:
+        giorno = data_turno(turno)
+        if giorno is None:
+            return None
+        per_data.setdefault(giorno, []).append(turno)
+    return per_data
+
+def salva_storico_6_mesi(dati, data_da, data_a, excursion_id=EXCURSION_ID):
+    """Aggiunge allo storico compatto (storico/turni.tsv) le variazioni dei turni già scaricati.
+
+    Se i turni non hanno una data riconoscibile salva il JSON completo come
+    calendario_YYYY-MM-DD.json, come in passato.
+    """
+    turni_per_data = indicizza_turni_per_data(dati.get("TURNOS", []))
     try:
-        resp = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=30)
-        if resp.status_code == 200:
-            nome_file = f"calendario_{oggi.strftime('%Y-%m-%d')}.json"
-            percorso = os.path.join(DIR_STORICO, nome_file)
-            
-            with open(percorso, "w") as f:
-                # Salviamo il JSON compatto per risparmiare spazio
-                json.dump(resp.json(), f)
-            print(f" [v] File storico salvato in {percorso}")
-        else:
-            print(f" [X] Errore API storico: {resp.status_code}")
+        if turni_per_data is not None:
+            variazioni = StoricoTurni(DIR_STORICO, excursion_id).registra(turni_per_data, data_da, data_a)
+            print(f" [v] Storico aggiornato: {variazioni} turni variati")
+            return
+
+        os.makedirs(DIR_STORICO, exist_ok=True)
+        suffisso = "" if excursion_id == EXCURSION_ID else f"_escursione_{excursion_id}"
+        nome_file = f"calendario_{datetime.now().strftime('%Y-%m-%d')}{suffisso}.json"
+        percorso = os.path.join(DIR_STORICO, nome_file)
+        with open(percorso, "w") as f:
+            # Salviamo il JSON compatto per risparmiare spazio
+            json.dump(dati, f)
+        print(f" [v] File storico salvato in {percorso}")
     except Exception as e:
         print(f" [!] Errore salvataggio storico: {e}")
 
-def controlla_singola_data(data_str):
-    """Restituisce: (testo_formattato, quantita_totale_posti)"""
-    url_corrente = f"https://api.hieloyaventura.com/api/hya/shifts?date_from={data_str}&date_to={data_str}&excursion_id={EXCURSION_ID}"
-    
+def carica_watchlist(percorso=None):
+    """Legge le regole da controllare dal file JSON indicato da HYA_WATCHLIST.
+
+    Ogni regola indica "excursion_id", "pickup" (stringa, lista o null per
+    tutti) e le date, come lista "date" oppure intervallo "dal"/"al"
+    (formato dd/mm/YYYY). Senza file si usa la configurazione classica
+    (EXCURSION_ID, PICKUP_RICHIESTO, DATE_DA_CONTROLLARE).
+    """
+    percorso = percorso or WATCHLIST
+    if not percorso:
+        regole = [{"excursion_id": EXCURSION_ID, "pickup": PICKUP_RICHIESTO, "date": DATE_DA_CONTROLLARE}]
+    else:
+        with open(percorso, encoding="utf-8") as f:
+            regole = json.load(f)
+
+    normalizzate = []
+    for regola in regole:
+        date = [datetime.strptime(d, "%d/%m/%Y").date() for d in regola.get("date", [])]
+        if regola.get("dal") and regola.get("al"):
+            giorno = datetime.strptime(regola["dal"], "%d/%m/%Y").date()
+            fine = datetime.strptime(regola["al"], "%d/%m/%Y").date()
+            while giorno <= fine:
+                date.append(giorno)
+                giorno += timedelta(days=1)
+        pickup = regola.get("pickup")
+        normalizzate.append({
+            "excursion_id": str(regola["excursion_id"]),
+            "pickup": [pickup] if isinstance(pickup, str) else pickup,
+            "date": sorted(set(date)),
+        })
+    return normalizzate
+
+def posti_turno(turno):
+    """Posti disponibili del turno (TOD + TRD), o None se i campi non sono numerici."""
     try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        resp = requests.get(url_corrente, headers=headers, timeout=20)
-        if resp.status_code != 200:
-            return None, 0
+        return int(turno.get("TOD", 0)) + int(turno.get("TRD", 0))
+    except (TypeError, ValueError):
+        return None
 
-        turni = resp.json().get("TURNOS", [])
-        
-        messaggi_escursione = []
-        posti_totali_giornata = 0
-        
-        for turno in turni:
-            if turno.get("PICKUP", "") == PICKUP_RICHIESTO:
-                posti_turno = int(turno.get("TOD", 0)) + int(turno.get("TRD", 0))
-                posti_totali_giornata += posti_turno
-                
-                if posti_turno > 0:
-                    messaggi_escursione.append(
-                        f"📅 <b>Data:</b> {data_str}\n"
-                        f"🕒 <b>Turno:</b> {turno.get('TURNO', '')} (Pickup {PICKUP_RICHIESTO})\n"
-                        f"🎟 <b>Posti disponibili:</b> {posti_turno}\n"
-                        f"💰 <b>Prezzo:</b> {turno.get('VALOR_TOTAL', '0')}"
-                    )
-
-        if messaggi_escursione:
-            return "\n\n".join(messaggi_escursione), posti_totali_giornata
-            
-    except Exception as e:
-        print(f" [!] Errore lettura {data_str}: {e}")
-        
-    return None, 0
+def valuta_regole(turni_per_data, regole):
+    """Valuta le regole di un'escursione sui turni già indicizzati per data.
+
+    Restituisce {(indice_regola, data): (posti totali, [posizioni in
+    turni_per_data[data] dei turni con posti])}. Ogni regola legge solo i
+    turni delle sue date; un pickup ripetuto nella regola conta una volta.
+    """
+    risultati = {}
+    for indice, regola in enumerate(regole):
+        pickup = None if regola["pickup"] is None else set(regola["pickup"])
+        for giorno in regola["date"]:
+            totale, righe = 0, []
+            for posizione, turno in enumerate(turni_per_data.get(giorno) or ()):
+                if pickup is not None and turno.get("PICKUP", "") not in pickup:
+                    continue
+                posti = posti_turno(turno)
+                if posti is None:
+                    continue
+                totale += posti
+                if posti > 0:
+                    righe.append(posizione)
+            risultati[(indice, giorno)] = (totale, righe)
+    return risultati
+
+def formatta_turni(turni, giorno, excursion_id):
+    """Testo HTML dei turni con posti disponibili per una data."""
+    messaggi = []
+    for turno in turni:
+        intestazione = "" if excursion_id == EXCURSION_ID else f"🏔 <b>Escursione:</b> {excursion_id}\n"
+        messaggi.append(
+            f"{intestazione}📅 <b>Data:</b> {giorno.strftime('%d/%m/%Y')}\n"
+            f"🕒 <b>Turno:</b> {turno.get('TURNO', '')} (Pickup {turno.get('PICKUP', '')})\n"
+            f"🎟 <b>Posti disponibili:</b> {posti_turno(turno)}\n"
+            f"💰 <b>Prezzo:</b> {turno.get('VALOR_TOTAL', '0')}"
+        )
+    return "\n\n".join(messaggi)
+
+def scarica_turni_pianificati(date_richieste, excursion_id=EXCURSION_ID):
+    """Scarica storico e date richieste con il minor numero di chiamate.
+
+    Restituisce ((inizio, fine, dati) dell'intervallo che contiene oggi, o None,
+    {data: lista turni o None se non disponibile}).
+    Se una risposta non permette di distinguere i turni per data, le date di
+    quell'intervallo vengono scaricate una per una.
+    """
+    oggi = datetime.now().date()
+    intervallo_storico = (oggi, oggi + timedelta(days=180))
+    piano = pianifica_intervalli(date_richieste, [intervallo_storico])
+    print(f"--- Piano di download: {len(piano)} chiamate per storico e {len(date_richieste)} date ---")
+
+    storico = None
+    turni_per_data = {}
+    for numero, (inizio, fine) in enumerate(piano):
+        if numero:
+            time.sleep(2)
+        dati = scarica_turni(inizio, fine, excursion_id)
+        if inizio <= oggi <= fine and dati is not None:
+            storico = (inizio, fine, dati)
 
+        date_intervallo = [d for d in date_richieste if inizio <= d <= fine]
+        indice = indicizza_turni_per_data(dati.get("TURNOS", [])) if dati is not None else None
+        for giorno in date_intervallo:
+            if dati is None:
+                turni_per_data[giorno] = None
+            elif indice is not None:
+                turni_per_data[giorno] = indice.get(giorno, [])
+            else:
+                print(f" [i] Turni senza data nella risposta: scarico {giorno.strftime('%d/%m/%Y')} separatamente.")
+                time.sleep(2)
+                dati_giorno = scarica_turni(giorno, giorno, excursion_id)
+                turni_per_data[giorno] = dati_giorno.get("TURNOS", []) if dati_giorno is not None else None
+    return storico, turni_per_data
+
+def controlla_escursione(excursion_id, regole):
+    """Scarica i turni di un'escursione, aggiorna lo storico e valuta le sue regole.
+
+    Restituisce ({chiave: posti} per ogni coppia regola/data, testi dei turni
+    con posti per data, posti totali). Un turno che soddisfa più regole
+    compare e viene contato una sola volta.
+    """
+    date_richieste = sorted({giorno for regola in regole for giorno in regola["date"]})
+    storico, turni_per_data = scarica_turni_pianificati(date_richieste, excursion_id)
+    if storico is not None:
+        data_da, data_a, dati_storico = storico
+        with metriche.fase('storico'):
+            salva_storico_6_mesi(dati_storico, data_da, data_a, excursion_id)
+
+    with metriche.fase('valutazione_regole'):
+        disponibili = {g: t for g, t in turni_per_data.items() if t is not None}
+        valutazioni = valuta_regole(disponibili, regole)
+    quantita = {}
+    righe_per_data = {}
+    for (indice, giorno), (posti, righe) in valutazioni.items():
+        regola = regole[indice]
+        pickup = "*" if regola["pickup"] is None else ",".join(regola["pickup"])
+        quantita[f"{excursion_id}|{pickup}|{giorno.strftime('%d/%m/%Y')}"] = posti
+        righe_per_data.setdefault(giorno, set()).update(righe)
+
+    testi = []
+    posti_totali = 0
+    for giorno in sorted(righe_per_data):
+        turni = [disponibili[giorno][riga] for riga in sorted(righe_per_data[giorno])]
+        posti_totali += sum(posti_turno(turno) for turno in turni)
+        if turni:
+            testi.append(formatta_turni(turni, giorno, excursion_id))
+    return quantita, testi, posti_totali
+
+@metriche.esecuzione('report_prezzi')
 def job_principale():
+    """Esegue un controllo completo. Restituisce True se la quantità di posti è cambiata."""
     print("=== AVVIO SCRIPT ===")
     
-    # 1. Salva lo storico dei 6 mesi in background
-    salva_storico_6_mesi()
-    time.sleep(2)
-    
-    # 2. Leggi la memoria del bot
+    # 1. Leggi la memoria del bot
     stato_precedente = {"ultima_data": "", "quantita": {}}
     if os.path.exists(FILE_STATO):
         with open(FILE_STATO, "r") as f:
@@ -125,22 +294,26 @@ def job_principale():
     gia_notificato_oggi = (stato_precedente.get("ultima_data") == oggi_str)
     quantita_precedenti = stato_precedente.get("quantita", {})
     
-    # 3. Controlla le disponibilità attuali
+    # 2. Scarica in parallelo le escursioni della watchlist (per ognuna il minor numero di chiamate)
+    regole_per_escursione = {}
+    for regola in carica_watchlist():
+        regole_per_escursione.setdefault(regola["excursion_id"], []).append(regola)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_ESCURSIONI_PARALLELE, len(regole_per_escursione)))) as executor:
+        esiti_per_escursione = list(executor.map(lambda voce: controlla_escursione(*voce), regole_per_escursione.items()))
+
+    # 3. Raccogli le disponibilità attuali
     quantita_attuali = {}
     messaggi_trovati = []
-    
-    for data in DATE_DA_CONTROLLARE:
-        print(f"--- Controllo {data} ---")
-        risultato_testo, qt_totale = controlla_singola_data(data)
-        quantita_attuali[data] = qt_totale
-        
-        if risultato_testo:
-            messaggi_trovati.append(risultato_testo)
-        time.sleep(2)
+    totale_posti_ora = 0
+    for quantita, testi, posti_totali in esiti_per_escursione:
+        quantita_attuali.update(quantita)
+        messaggi_trovati.extend(testi)
+        totale_posti_ora += posti_totali
 
     # 4. Verifica se ci sono state variazioni numeriche rispetto all'ultimo check
     variazione_rilevata = False
-    for data in DATE_DA_CONTROLLARE:
+    for data in quantita_attuali:
         if quantita_attuali.get(data, 0) != quantita_precedenti.get(data, 0):
             variazione_rilevata = True
             break
@@ -162,8 +335,6 @@ def job_principale():
 
     # 6. Spedizione Telegram e salvataggio stato
     if invia_messaggio:
-        totale_posti_ora = sum(quantita_attuali.values())
-        
         if totale_posti_ora > 0:
             testo_finale = titolo + "\n\n---\n\n".join(messaggi_trovati)
             testo_finale += "\n\n👉 <a href='https://hieloyaventura.com/'>Vai al sito ufficiale</a>"
@@ -180,5 +351,7 @@ def job_principale():
         with open(FILE_STATO, "w") as f:
             json.dump(nuovo_stato, f, indent=2)
 
+    return variazione_rilevata
+
 if __name__ == "__main__":
     job_principale()
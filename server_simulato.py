@@ -0,0 +1,199 @@
+"""Server HTTP locale che sostituisce i siti reali durante le prove.
+
+Riproduce risposte registrate in precedenza: ogni file .json nella cartella
+indicata descrive una risposta nel formato
+
+    {"method": "POST", "path": "/website/ticket/solutions",
+     "query": {"name": "Roma Termini"},          (facoltativo)
+     "status": 200, "headers": {...},           (facoltativi)
+     "body": {...} oppure "body_file": "pagina.html"}
+
+I file indicati da body_file stanno nella stessa cartella e non devono avere
+estensione .json. Le registrazioni di esempio in fixtures/registrazioni
+coprono la ricerca Roma Termini -> Milano Centrale (stazioni e soluzioni).
+
+Uso: python server_simulato.py <cartella_registrazioni> [porta]
+ad esempio python server_simulato.py fixtures/registrazioni e poi
+LEFRECCE_API_URL=http://127.0.0.1:8765/website CERCA_TRENI_BACKEND=http
+
+Per le prove dello stato c'è anche un finto JSONBin (rotte_jsonbin), da
+usare con JSONBIN_BASE_URL=http://127.0.0.1:<porta>/v3, e una finta Bot API
+di Telegram (rotte_telegram), da usare con TELEGRAM_API_URL=http://127.0.0.1:<porta>.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def carica_registrazioni(cartella):
+    """Legge le risposte registrate e le raggruppa per (metodo, percorso)."""
+    rotte = {}
+    for nome in sorted(os.listdir(cartella)):
+        if not nome.endswith('.json'):
+            continue
+        with open(os.path.join(cartella, nome), encoding='utf-8') as f:
+            reg = json.load(f)
+        if not isinstance(reg, dict) or 'path' not in reg:
+            raise ValueError(f"{os.path.join(cartella, nome)} non è una registrazione: manca il campo 'path'")
+        if 'body_file' in reg:
+            with open(os.path.join(cartella, reg['body_file']), 'rb') as f:
+                reg['body'] = f.read()
+        chiave = (reg.get('method', 'GET').upper(), reg['path'])
+        rotte.setdefault(chiave, []).append(reg)
+    return rotte
+
+
+def _risposta_registrata(registrazioni):
+    def gestore(richiesta):
+        for reg in registrazioni:
+            attesa = reg.get('query') or {}
+            if all(richiesta['query'].get(k) == str(v) for k, v in attesa.items()):
+                return reg.get('status', 200), reg.get('headers', {}), reg.get('body', b'')
+        return 404, {}, {'errore': 'nessuna registrazione corrispondente'}
+    return gestore
+
+
+def rotte_jsonbin(bin_id, api_key, record=None):
+    """Rotte che imitano l'API di JSONBin.io per un bin: GET /v3/b/<id>/latest e PUT /v3/b/<id>.
+
+    Restituisce (rotte, contenuto): contenuto['record'] è lo stato salvato.
+    Le richieste senza la X-Master-Key corretta ricevono 401.
+    """
+    contenuto = {'record': record if record is not None else {}, 'versione': 1}
+
+    def autorizzata(richiesta):
+        return richiesta['headers'].get('X-Master-Key') == api_key
+
+    def leggi(richiesta):
+        if not autorizzata(richiesta):
+            return 401, {}, {'message': 'X-Master-Key non valida'}
+        return 200, {}, {'record': contenuto['record'],
+                         'metadata': {'id': bin_id, 'version': contenuto['versione']}}
+
+    def scrivi(richiesta):
+        if not autorizzata(richiesta):
+            return 401, {}, {'message': 'X-Master-Key non valida'}
+        try:
+            contenuto['record'] = json.loads(richiesta['body'] or b'{}')
+        except ValueError:
+            return 400, {}, {'message': 'JSON non valido'}
+        contenuto['versione'] += 1
+        return 200, {}, {'record': contenuto['record'], 'metadata': {'parentId': bin_id}}
+
+    rotte = {
+        ('GET', f'/v3/b/{bin_id}/latest'): leggi,
+        ('PUT', f'/v3/b/{bin_id}'): scrivi,
+    }
+    return rotte, contenuto
+
+
+def rotte_telegram(token, intervallo_minimo=0.0, retry_after=1):
+    """Rotte che imitano la Bot API di Telegram: POST /bot<token>/sendMessage.
+
+    Restituisce (rotte, messaggi): messaggi è la lista dei payload accettati.
+    Come il servizio reale, rifiuta con 400 i testi oltre 4096 caratteri e,
+    se due messaggi arrivano a meno di `intervallo_minimo` secondi, risponde
+    429 con parameters.retry_after.
+    """
+    messaggi = []
+    ultimo = {'istante': None}
+    lock = threading.Lock()
+
+    def invia(richiesta):
+        try:
+            payload = json.loads(richiesta['body'] or b'{}')
+        except ValueError:
+            payload = dict(urllib.parse.parse_qsl(richiesta['body'].decode('utf-8')))
+        testo = payload.get('text', '')
+        if not testo or not payload.get('chat_id'):
+            return 400, {}, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message text is empty'}
+        if len(testo) > 4096:
+            return 400, {}, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message is too long'}
+        with lock:
+            adesso = time.monotonic()
+            if ultimo['istante'] is not None and adesso - ultimo['istante'] < intervallo_minimo:
+                return 429, {}, {'ok': False, 'error_code': 429,
+                                 'description': f'Too Many Requests: retry after {retry_after}',
+                                 'parameters': {'retry_after': retry_after}}
+            ultimo['istante'] = adesso
+            messaggi.append(payload)
+            return 200, {}, {'ok': True, 'result': {'message_id': len(messaggi), 'text': testo}}
+
+    return {('POST', f'/bot{token}/sendMessage'): invia}, messaggi
+
+
+class _Gestore(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Intestazioni e corpo sono scritti separatamente: senza TCP_NODELAY ogni
+    # risposta attenderebbe l'ACK ritardato del client (~40 ms)
+    disable_nagle_algorithm = True
+
+    def _rispondi(self):
+        parti = urllib.parse.urlsplit(self.path)
+        lunghezza = int(self.headers.get('Content-Length') or 0)
+        richiesta = {
+            'method': self.command,
+            'path': parti.path,
+            'query': dict(urllib.parse.parse_qsl(parti.query)),
+            'headers': self.headers,
+            'body': self.rfile.read(lunghezza) if lunghezza else b'',
+        }
+        self.server.richieste.append(richiesta)
+
+        gestore = self.server.rotte.get((self.command, parti.path))
+        if gestore is None:
+            status, headers, corpo = 404, {}, {'errore': 'percorso sconosciuto'}
+        else:
+            status, headers, corpo = gestore(richiesta)
+
+        if isinstance(corpo, (dict, list)):
+            corpo = json.dumps(corpo).encode('utf-8')
+            headers = {'Content-Type': 'application/json', **headers}
+        elif isinstance(corpo, str):
+            corpo = corpo.encode('utf-8')
+
+        self.send_response(status)
+        for nome, valore in headers.items():
+            self.send_header(nome, valore)
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(corpo)
+
+    do_GET = do_POST = do_PUT = do_HEAD = _rispondi
+
+    def log_message(self, *args):
+        pass
+
+
+def avvia_server(rotte, porta=0):
+    """Avvia il server in un thread e restituisce (server, url_base).
+
+    `rotte` associa (metodo, percorso) a una funzione che riceve la richiesta
+    e restituisce (status, headers, corpo); le liste di registrazioni lette
+    con carica_registrazioni sono accettate direttamente. Le richieste
+    ricevute restano in server.richieste. Fermarlo con server.shutdown().
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', porta), _Gestore)
+    server.daemon_threads = True
+    server.rotte = {chiave: (_risposta_registrata(valore) if isinstance(valore, list) else valore)
+                    for chiave, valore in rotte.items()}
+    server.richieste = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    server, url = avvia_server(carica_registrazioni(sys.argv[1]), int(sys.argv[2]) if len(sys.argv) > 2 else 8765)
+    print(f"Server simulato in ascolto su {url} (Ctrl+C per fermarlo)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+# --- CONFIGURAZIONE ---
+# Per default lo storico sta nello stesso file della cache dei risultati
+HISTORY_PATH = os.environ.get('CERCA_TRENI_STORICO', os.environ.get('CERCA_TRENI_CACHE', 'cache_treni.sqlite'))
+# Avvisa anche quando il prezzo scende almeno di questa percentuale rispetto all'ultima rilevazione
+DROP_ALERT_PERCENT = float(os.environ.get('CERCA_TRENI_DROP_ALERT_PERCENT', '10'))
+# --- FINE CONFIGURAZIONE ---
+
+
+class PriceHistory:
+    """Storico append-only dei prezzi per (tratta, data, orario di partenza).
+
+    Ogni rilevazione viene aggiunta a `price_observations`; `price_summary`
+    fa da indice con minimo storico e ultimo prezzo di ogni treno, così
+    "minimo di sempre" e "nuovo minimo?" sono una ricerca sulla chiave primaria
+    e l'andamento di un treno una scansione ordinata dell'indice.
+    """
+
+    def __init__(self, path=HISTORY_PATH, drop_alert_percent=DROP_ALERT_PERCENT):
+        self.drop_alert_percent = drop_alert_percent
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS price_observations (
+                    route TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    departure TEXT NOT NULL,
+                    observed_at REAL NOT NULL,
+                    price REAL NOT NULL
+                )
+            """)
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS price_observations_train
+                ON price_observations (route, date, departure, observed_at)
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS price_summary (
+                    route TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    departure TEXT NOT NULL,
+                    min_price REAL NOT NULL,
+                    min_observed_at REAL NOT NULL,
+                    last_price REAL NOT NULL,
+                    last_observed_at REAL NOT NULL,
+                    observations INTEGER NOT NULL,
+                    PRIMARY KEY (route, date, departure)
+                )
+            """)
+
+    def summary(self, route, date, departure):
+        row = self.conn.execute(
+            "SELECT min_price, min_observed_at, last_price, last_observed_at, observations "
+            "FROM price_summary WHERE route = ? AND date = ? AND departure = ?",
+            (route, date, departure)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('min_price', 'min_observed_at', 'last_price', 'last_observed_at', 'observations'), row))
+
+    def lowest_price(self, route, date, departure):
+        """Prezzo più basso mai visto per il treno (None se mai visto)."""
+        summary = self.summary(route, date, departure)
+        return summary['min_price'] if summary else None
+
+    def is_new_minimum(self, route, date, departure, price):
+        lowest = self.lowest_price(route, date, departure)
+        return lowest is None or price < lowest
+
+    def trend(self, route, date, departure):
+        """Andamento del prezzo del treno: lista di (timestamp, prezzo) in ordine cronologico."""
+        return self.conn.execute(
+            "SELECT observed_at, price FROM price_observations "
+            "WHERE route = ? AND date = ? AND departure = ? ORDER BY observed_at",
+            (route, date, departure)).fetchall()
+
+    def volatility_by_date(self, route, since):
+        """Volatilità dei prezzi di ogni data della tratta dalle rilevazioni successive a `since`.
+
+        È la variazione relativa media tra due rilevazioni consecutive dello
+        stesso treno: {data: valore}, 0 per le date con prezzi stabili.
+        """
+        changes = {}
+        previous_train, previous_price = None, None
+        for date, departure, price in self.conn.execute(
+                "SELECT date, departure, price FROM price_observations "
+                "WHERE route = ? AND observed_at >= ? ORDER BY date, departure, observed_at",
+                (route, since)):
+            total, count = changes.get(date, (0.0, 0))
+            if (date, departure) == previous_train and previous_price > 0:
+                total, count = total + abs(price - previous_price) / previous_price, count + 1
+            changes[date] = (total, count)
+            previous_train, previous_price = (date, departure), price
+        return {date: total / count if count else 0.0 for date, (total, count) in changes.items()}
+
+    def alert_for(self, route, date, departure, price, previous=None):
+        """Avviso che genererebbe la rilevazione (senza registrarla), o None.
+
+        L'avviso scatta per un nuovo minimo (anche la prima rilevazione di un
+        treno) o per un calo di almeno `drop_alert_percent` rispetto
+        all'ultimo prezzo visto.
+        """
+        previous = previous or self.summary(route, date, departure)
+        alert = None
+        if previous is None or price < previous['min_price']:
+            alert = {'kind': 'new_minimum', 'price': price,
+                     'previous_min': previous['min_price'] if previous else None}
+        elif previous['last_price'] > 0:
+            drop = (previous['last_price'] - price) / previous['last_price'] * 100
+            if drop >= self.drop_alert_percent:
+                alert = {'kind': 'drop', 'price': price, 'previous_price': previous['last_price'],
+                         'drop_percent': drop, 'min_price': previous['min_price']}
+        return alert
+
+    def record(self, route, date, departure, price, now=None):
+        """Registra una rilevazione e restituisce l'avviso da inviare, o None (vedi alert_for)."""
+        now = now or time.time()
+        previous = self.summary(route, date, departure)
+        alert = self.alert_for(route, date, departure, price, previous)
+
+        with self.conn:
+            self.conn.execute("INSERT INTO price_observations VALUES (?, ?, ?, ?, ?)",
+                              (route, date, departure, now, price))
+            if previous is None:
+                self.conn.execute("INSERT INTO price_summary VALUES (?, ?, ?, ?, ?, ?, ?, 1)",
+                                  (route, date, departure, price, now, price, now))
+            else:
+                new_min = price < previous['min_price']
+                self.conn.execute(
+                    "UPDATE price_summary SET min_price = ?, min_observed_at = ?, last_price = ?, "
+                    "last_observed_at = ?, observations = observations + 1 "
+                    "WHERE route = ? AND date = ? AND departure = ?",
+                    (price if new_min else previous['min_price'],
+                     now if new_min else previous['min_observed_at'],
+                     price, now, route, date, departure))
+        return alert
+
+    def purge_before(self, date_obj):
+        """Elimina rilevazioni e indice delle date ormai passate."""
+        stale = [(row[0],) for row in self.conn.execute("SELECT DISTINCT date FROM price_summary")
+                 if datetime.strptime(row[0], '%d-%m-%Y') < date_obj]
+        with self.conn:
+            self.conn.executemany("DELETE FROM price_observations WHERE date = ?", stale)
+            self.conn.executemany("DELETE FROM price_summary WHERE date = ?", stale)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,219 @@
+"""Storico compatto dei turni di report_prezzi.
+
+Al posto di un calendario_YYYY-MM-DD.json completo per ogni esecuzione, il
+file storico/turni_<escursione>.tsv contiene solo le variazioni: una riga per ogni turno
+(data, turno, pickup) i cui TOD/TRD/VALOR_TOTAL sono cambiati rispetto
+all'ultima rilevazione, con il timestamp della rilevazione. Un turno
+sparito dal calendario è registrato con i valori a '-'.
+
+Il file è solo in append; le interrogazioni lo leggono tramite mmap,
+cercando direttamente i byte della data richiesta, senza caricarlo tutto.
+Gli ultimi valori dei turni da oggi in poi stanno in turni_<escursione>.last.json,
+con cui ogni nuova rilevazione viene confrontata; se manca o non corrisponde
+al file (es. dopo un'interruzione tra le due scritture) viene ricostruito
+leggendo tutto lo storico una volta.
+
+Uso:
+  python storico_turni.py importa [cartella]       converte i vecchi calendario_*.json
+  python storico_turni.py serie <dd/mm/YYYY> [pickup] [turno] [escursione]
+"""
+import glob
+import json
+import mmap
+import os
+import sys
+from datetime import datetime
+
+DIR_STORICO = "storico"
+FILE_TURNI = "turni_{excursion_id}.tsv"
+FILE_ULTIMO_STATO = "turni_{excursion_id}.last.json"
+CAMPI = ('ts', 'data', 'turno', 'pickup', 'tod', 'trd', 'valor_total')
+RIMOSSO = '-'
+
+
+def _pulisci(valore):
+    return str(valore if valore is not None else '').replace('\t', ' ').replace('\n', ' ')
+
+
+def _riga(ts, data, turno, pickup, valori):
+    return "\t".join([str(int(ts)), data.isoformat(), _pulisci(turno), _pulisci(pickup), *valori]) + "\n"
+
+
+def _record(riga):
+    parti = riga.rstrip("\n").split("\t")
+    if len(parti) != len(CAMPI):
+        return None
+    record = dict(zip(CAMPI, parti))
+    record['ts'] = int(record['ts'])
+    return record
+
+
+class StoricoTurni:
+    """Archivio append-only delle variazioni dei turni."""
+
+    def __init__(self, cartella=DIR_STORICO, excursion_id="1"):
+        os.makedirs(cartella, exist_ok=True)
+        self.percorso = os.path.join(cartella, FILE_TURNI.format(excursion_id=excursion_id))
+        self.percorso_ultimo = os.path.join(cartella, FILE_ULTIMO_STATO.format(excursion_id=excursion_id))
+
+    def _righe(self, filtro=None):
+        """Scorre le righe del file (solo quelle che contengono `filtro`, se indicato)."""
+        if not os.path.exists(self.percorso) or os.path.getsize(self.percorso) == 0:
+            return
+        with open(self.percorso, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if filtro is None:
+                for riga in iter(mm.readline, b''):
+                    yield riga.decode('utf-8')
+                return
+            posizione = mm.find(filtro)
+            while posizione != -1:
+                inizio = mm.rfind(b"\n", 0, posizione) + 1
+                fine = mm.find(b"\n", posizione)
+                fine = len(mm) if fine == -1 else fine + 1
+                yield mm[inizio:fine].decode('utf-8')
+                posizione = mm.find(filtro, fine)
+
+    def ultimo_stato(self):
+        """Ultimi valori noti di ogni turno: {(data, turno, pickup): (tod, trd, valor_total)}."""
+        stato = {}
+        for riga in self._righe():
+            record = _record(riga)
+            if record is None:
+                continue
+            chiave = (record['data'], record['turno'], record['pickup'])
+            valori = (record['tod'], record['trd'], record['valor_total'])
+            if valori == (RIMOSSO,) * 3:
+                stato.pop(chiave, None)
+            else:
+                stato[chiave] = valori
+        return stato
+
+    def _dimensione(self):
+        return os.path.getsize(self.percorso) if os.path.exists(self.percorso) else 0
+
+    def _leggi_ultimo_stato(self):
+        """Ultimo stato salvato accanto allo storico, o None se manca o non corrisponde al file."""
+        try:
+            with open(self.percorso_ultimo, encoding='utf-8') as f:
+                salvato = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if salvato.get('dimensione_tsv') != self._dimensione():
+            return None
+        return {tuple(voce[:3]): tuple(voce[3:]) for voce in salvato.get('turni', [])}
+
+    def _salva_ultimo_stato(self, stato, dal):
+        """Salva l'ultimo stato dei turni dalla data `dal` in poi (in modo atomico)."""
+        turni = [[*chiave, *valori] for chiave, valori in sorted(stato.items()) if chiave[0] >= dal]
+        temporaneo = f"{self.percorso_ultimo}.tmp"
+        with open(temporaneo, 'w', encoding='utf-8') as f:
+            json.dump({'dimensione_tsv': self._dimensione(), 'turni': turni}, f, ensure_ascii=False)
+        os.replace(temporaneo, self.percorso_ultimo)
+
+    def registra(self, turni_per_data, data_da, data_a, istante=None):
+        """Aggiunge al file le variazioni rispetto all'ultimo stato noto.
+
+        `turni_per_data` associa ogni data (datetime.date) alla lista dei turni
+        dell'API; i turni noti con data tra data_da e data_a che non compaiono
+        più vengono registrati come rimossi. Il confronto usa l'ultimo stato
+        salvato (FILE_ULTIMO_STATO), non l'intero storico. Restituisce il
+        numero di righe scritte.
+        """
+        ts = (istante or datetime.now()).timestamp()
+        precedente = self._leggi_ultimo_stato()
+        if precedente is None:
+            precedente = self.ultimo_stato()
+        attuale = dict(precedente)
+        righe = []
+        visti = set()
+        for data in sorted(turni_per_data):
+            for turno in turni_per_data[data]:
+                chiave = (data.isoformat(), _pulisci(turno.get('TURNO', '')), _pulisci(turno.get('PICKUP', '')))
+                valori = tuple(_pulisci(turno.get(campo, '')) for campo in ('TOD', 'TRD', 'VALOR_TOTAL'))
+                visti.add(chiave)
+                if precedente.get(chiave) != valori:
+                    righe.append(_riga(ts, data, chiave[1], chiave[2], valori))
+                    attuale[chiave] = valori
+
+        inizio, fine = data_da.isoformat(), data_a.isoformat()
+        for chiave in sorted(precedente):
+            if inizio <= chiave[0] <= fine and chiave not in visti:
+                data = datetime.strptime(chiave[0], "%Y-%m-%d").date()
+                righe.append(_riga(ts, data, chiave[1], chiave[2], (RIMOSSO,) * 3))
+                del attuale[chiave]
+
+        if righe:
+            with open(self.percorso, 'a', encoding='utf-8') as f:
+                f.writelines(righe)
+        # Le date precedenti all'intervallo non vengono più confrontate: l'ultimo stato resta piccolo
+        self._salva_ultimo_stato(attuale, inizio)
+        return len(righe)
+
+    def serie(self, data, turno=None, pickup=None):
+        """Variazioni registrate per una data (datetime.date), in ordine cronologico."""
+        filtro = f"\t{data.isoformat()}\t".encode('utf-8')
+        risultati = []
+        for riga in self._righe(filtro):
+            record = _record(riga)
+            if record is None or record['data'] != data.isoformat():
+                continue
+            if (turno is None or record['turno'] == turno) and (pickup is None or record['pickup'] == pickup):
+                risultati.append(record)
+        return risultati
+
+    def disponibilita_nel_tempo(self, data, turno=None, pickup=None):
+        """Lista di (istante, turno, pickup, posti) con posti = TOD + TRD (0 se il turno è sparito)."""
+        serie = []
+        for record in self.serie(data, turno, pickup):
+            try:
+                posti = int(record['tod']) + int(record['trd'])
+            except ValueError:
+                posti = 0
+            serie.append((datetime.fromtimestamp(record['ts']), record['turno'], record['pickup'], posti))
+        return serie
+
+    def prezzo_nel_tempo(self, data, turno=None, pickup=None):
+        """Lista di (istante, turno, pickup, VALOR_TOTAL), escluse le rimozioni."""
+        return [(datetime.fromtimestamp(r['ts']), r['turno'], r['pickup'], r['valor_total'])
+                for r in self.serie(data, turno, pickup) if r['valor_total'] != RIMOSSO]
+
+
+def importa_calendari(raggruppa, cartella=DIR_STORICO):
+    """Converte i vecchi calendario_YYYY-MM-DD.json nello storico compatto, in ordine di data.
+
+    `raggruppa` trasforma la lista TURNOS in {data: turni} (di solito
+    report_prezzi.indicizza_turni_per_data). I file JSON non vengono cancellati.
+    """
+    storico = StoricoTurni(cartella)
+    totale = 0
+    for percorso in sorted(glob.glob(os.path.join(cartella, "calendario_*.json"))):
+        giorno = datetime.strptime(os.path.basename(percorso)[len("calendario_"):-len(".json")], "%Y-%m-%d")
+        with open(percorso) as f:
+            turni_per_data = raggruppa(json.load(f).get("TURNOS", []))
+        if turni_per_data is None:
+            print(f" [!] {percorso}: turni senza data riconoscibile, ignorato.")
+            continue
+        if not turni_per_data:
+            continue
+        scritte = storico.registra(turni_per_data, min(turni_per_data), max(turni_per_data), istante=giorno)
+        print(f" [v] {os.path.basename(percorso)}: {scritte} variazioni")
+        totale += scritte
+    return totale
+
+
+if __name__ == '__main__':
+    comando = sys.argv[1] if len(sys.argv) > 1 else ''
+    if comando == 'importa':
+        from report_prezzi import indicizza_turni_per_data
+        importa_calendari(indicizza_turni_per_data, sys.argv[2] if len(sys.argv) > 2 else DIR_STORICO)
+    elif comando == 'serie' and len(sys.argv) > 2:
+        data = datetime.strptime(sys.argv[2], "%d/%m/%Y").date()
+        pickup = sys.argv[3] if len(sys.argv) > 3 else None
+        turno = sys.argv[4] if len(sys.argv) > 4 else None
+        escursione = sys.argv[5] if len(sys.argv) > 5 else "1"
+        for record in StoricoTurni(excursion_id=escursione).serie(data, turno, pickup):
+            istante = datetime.fromtimestamp(record['ts']).strftime('%d/%m/%Y %H:%M')
+            print(f"{istante}  turno {record['turno']}  pickup {record['pickup']}  "
+                  f"TOD {record['tod']}  TRD {record['trd']}  prezzo {record['valor_total']}")
+    else:
+        print(__doc__)
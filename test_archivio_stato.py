@@ -0,0 +1,107 @@
+"""Prove degli archivi dello stato contro il finto JSONBin di server_simulato.
+
+Uso: python -m pytest test_archivio_stato.py (oppure python -m unittest)
+"""
+import os
+import tempfile
+import unittest
+
+from archivio_stato import ArchivioCoalescente, ArchivioFile, ArchivioJSONBin, ArchivioStato
+from server_simulato import avvia_server, rotte_jsonbin
+
+BIN_ID = 'bin-prova'
+API_KEY = 'chiave-prova'
+
+
+class TestArchivioJSONBin(unittest.TestCase):
+
+    def setUp(self):
+        rotte, self.contenuto = rotte_jsonbin(BIN_ID, API_KEY, record={'pagine': {}})
+        self.server, url = avvia_server(rotte)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = f"{url}/v3"
+
+    def test_scrive_e_rilegge_lo_stato(self):
+        archivio = ArchivioJSONBin(BIN_ID, API_KEY, base_url=self.base_url)
+        self.assertEqual(archivio.leggi(), {'pagine': {}})
+        self.assertTrue(archivio.scrivi({'biglietti': ['08:30']}))
+        self.assertEqual(self.contenuto['record'], {'biglietti': ['08:30']})
+        self.assertEqual(archivio.leggi(), {'biglietti': ['08:30']})
+
+    def test_chiave_errata_401(self):
+        archivio = ArchivioJSONBin(BIN_ID, 'chiave-sbagliata', base_url=self.base_url)
+        self.assertIsNone(archivio.leggi())
+        self.assertFalse(archivio.scrivi({'biglietti': []}))
+        self.assertEqual(self.contenuto['record'], {'pagine': {}})
+
+
+class TestArchivioCoalescente(unittest.TestCase):
+
+    def setUp(self):
+        rotte, self.contenuto = rotte_jsonbin(BIN_ID, API_KEY, record={'versione': 1})
+        self.server, url = avvia_server(rotte)
+        self.addCleanup(self.server.shutdown)
+        cartella = tempfile.TemporaryDirectory()
+        self.addCleanup(cartella.cleanup)
+        self.locale = ArchivioFile(os.path.join(cartella.name, 'stato.json'))
+        self.remoto = ArchivioJSONBin(BIN_ID, API_KEY, base_url=f"{url}/v3")
+
+    def scritture_remote(self):
+        return sum(1 for richiesta in self.server.richieste if richiesta['method'] == 'PUT')
+
+    def test_primo_avvio_parte_dalla_copia_remota(self):
+        archivio = ArchivioCoalescente(self.locale, self.remoto)
+        self.assertEqual(archivio.leggi(), {'versione': 1})
+        self.assertEqual(self.locale.leggi(), {'versione': 1})
+
+    def test_piu_scritture_diventano_una_sola_richiesta(self):
+        archivio = ArchivioCoalescente(self.locale, self.remoto)
+        for versione in (2, 3, 4):
+            self.assertTrue(archivio.scrivi({'versione': versione}))
+        self.assertEqual(self.scritture_remote(), 0)
+        self.assertEqual(self.locale.leggi(), {'versione': 4})
+
+        self.assertTrue(archivio.flush())
+        self.assertEqual(self.scritture_remote(), 1)
+        self.assertEqual(self.contenuto['record'], {'versione': 4})
+
+        # Nessuna modifica dopo l'ultimo invio: il flush non chiama il remoto
+        archivio.scrivi({'versione': 4})
+        self.assertTrue(archivio.flush())
+        self.assertEqual(self.scritture_remote(), 1)
+
+    def test_stato_uguale_al_remoto_non_viene_inviato(self):
+        archivio = ArchivioCoalescente(self.locale, self.remoto)
+        archivio.leggi()
+        archivio.scrivi({'versione': 1})
+        self.assertTrue(archivio.flush())
+        self.assertEqual(self.scritture_remote(), 0)
+
+    def test_errore_remoto_lascia_lo_stato_in_attesa(self):
+        self.remoto.session.headers['X-Master-Key'] = 'chiave-sbagliata'
+        archivio = ArchivioCoalescente(self.locale, self.remoto)
+        archivio.scrivi({'versione': 5})
+        self.assertFalse(archivio.flush())
+        self.assertEqual(self.contenuto['record'], {'versione': 1})
+
+        self.remoto.session.headers['X-Master-Key'] = API_KEY
+        self.assertTrue(archivio.flush())
+        self.assertEqual(self.contenuto['record'], {'versione': 5})
+
+
+class TestArchivioStato(unittest.TestCase):
+
+    def test_interfaccia_astratta(self):
+        with self.assertRaises(TypeError):
+            ArchivioStato()
+
+        class SoloLettura(ArchivioStato):
+            def leggi(self):
+                return {}
+
+        with self.assertRaises(TypeError):
+            SoloLettura()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""Prove dell'invio a Telegram contro la finta Bot API di server_simulato.
+
+Uso: python -m pytest test_notifiche_telegram.py (oppure python -m unittest)
+"""
+import time
+import unittest
+
+import notifiche_telegram
+from notifiche_telegram import LIMITE_CARATTERI, CodaTelegram, dividi_testo, invia
+from server_simulato import avvia_server, rotte_telegram
+
+TOKEN = 'token-prova'
+CHAT_ID = '42'
+
+
+class ProvaTelegram(unittest.TestCase):
+    intervallo_minimo = 0.0
+    retry_after = 1
+
+    def setUp(self):
+        rotte, self.messaggi = rotte_telegram(TOKEN, self.intervallo_minimo, self.retry_after)
+        self.server, url = avvia_server(rotte)
+        self.addCleanup(self.server.shutdown)
+        url_originale = notifiche_telegram.TELEGRAM_API_URL
+        notifiche_telegram.TELEGRAM_API_URL = url
+        self.addCleanup(setattr, notifiche_telegram, 'TELEGRAM_API_URL', url_originale)
+
+
+class TestDividiTesto(unittest.TestCase):
+
+    def test_divide_tra_le_righe(self):
+        righe = [f"• riga {numero} | <b>{numero},00 €</b>" for numero in range(600)]
+        parti = dividi_testo("\n".join(righe))
+        self.assertGreater(len(parti), 1)
+        self.assertTrue(all(len(parte) <= LIMITE_CARATTERI for parte in parti))
+        self.assertEqual("\n".join(parti).split("\n"), righe)
+
+    def test_riga_piu_lunga_del_limite(self):
+        parti = dividi_testo("x" * (LIMITE_CARATTERI * 2 + 10))
+        self.assertEqual([len(parte) for parte in parti], [LIMITE_CARATTERI, LIMITE_CARATTERI, 10])
+
+
+class TestInvia(ProvaTelegram):
+
+    def test_testo_lungo_inviato_in_piu_parti(self):
+        testo = "\n".join(f"• biglietto {numero}: <b>{numero} €</b>" for numero in range(500))
+        self.assertTrue(invia(testo, token=TOKEN, chat_id=CHAT_ID,
+                              reply_markup={'inline_keyboard': []}))
+        self.assertGreater(len(self.messaggi), 1)
+        self.assertEqual("\n".join(m['text'] for m in self.messaggi), testo)
+        # La tastiera va solo sull'ultima parte
+        self.assertEqual([('reply_markup' in m) for m in self.messaggi],
+                         [False] * (len(self.messaggi) - 1) + [True])
+
+    def test_senza_token(self):
+        self.assertFalse(invia("ciao", token='', chat_id=''))
+        self.assertEqual(self.server.richieste, [])
+
+
+class TestRetryAfter(ProvaTelegram):
+    intervallo_minimo = 0.5
+    retry_after = 1
+
+    def test_429_rispetta_retry_after(self):
+        inizio = time.monotonic()
+        self.assertTrue(invia("primo", token=TOKEN, chat_id=CHAT_ID))
+        self.assertTrue(invia("secondo", token=TOKEN, chat_id=CHAT_ID))
+        self.assertGreaterEqual(time.monotonic() - inizio, self.retry_after)
+        self.assertEqual([m['text'] for m in self.messaggi], ["primo", "secondo"])
+        self.assertEqual(len(self.server.richieste), 3)
+
+
+class TestRetryAfterTroppoLungo(ProvaTelegram):
+    intervallo_minimo = 60
+    retry_after = notifiche_telegram.MAX_ATTESA_RETRY + 1
+
+    def test_attesa_oltre_il_massimo_scarta_il_messaggio(self):
+        self.assertTrue(invia("primo", token=TOKEN, chat_id=CHAT_ID))
+        inizio = time.monotonic()
+        self.assertFalse(invia("secondo", token=TOKEN, chat_id=CHAT_ID))
+        self.assertLess(time.monotonic() - inizio, 1)
+
+    def test_coda_riporta_le_chiavi_non_consegnate(self):
+        coda = CodaTelegram(token=TOKEN, chat_id=CHAT_ID)
+        for numero in range(30):
+            coda.accoda(f"<b>Pagina {numero}</b>\n" + "• biglietto\n" * 30, chiave=numero)
+        blocchi = coda.blocchi()
+        self.assertGreater(len(blocchi), 1)
+
+        self.assertFalse(coda.svuota())
+        # Solo il primo blocco arriva: le sue chiavi non sono tra le non consegnate
+        self.assertEqual(len(self.messaggi), 1)
+        consegnate = blocchi[0][1] - set().union(*(chiavi for _, chiavi in blocchi[1:]))
+        self.assertTrue(consegnate)
+        self.assertEqual(coda.non_consegnati, set(range(30)) - consegnate)
+
+
+class TestCodaTelegram(ProvaTelegram):
+
+    def test_messaggi_brevi_uniti_in_pochi_blocchi(self):
+        coda = CodaTelegram('MarkdownV2', token=TOKEN, chat_id=CHAT_ID)
+        for numero in range(200):
+            coda.accoda(f"*Data {numero}*\n  🕒 08:00 \\-\\> 11:00", chiave=numero)
+        self.assertTrue(coda.svuota())
+        self.assertEqual(coda.non_consegnati, set())
+        self.assertLess(len(self.messaggi), 10)
+        self.assertTrue(all(len(m['text']) <= LIMITE_CARATTERI for m in self.messaggi))
+        self.assertTrue(all(m['parse_mode'] == 'MarkdownV2' for m in self.messaggi))
+        self.assertEqual(sum(m['text'].count('*Data ') for m in self.messaggi), 200)
+
+    def test_separatore_per_messaggio(self):
+        coda = CodaTelegram(token=TOKEN, chat_id=CHAT_ID)
+        coda.accoda("<b>Attive</b>")
+        coda.accoda("• pagina 1", chiave='pagina 1', separatore="\n")
+        coda.accoda("• pagina 2", chiave='pagina 2', separatore="\n")
+        coda.accoda("<b>Errori</b>")
+        self.assertEqual(coda.blocchi(), [("<b>Attive</b>\n• pagina 1\n• pagina 2\n\n<b>Errori</b>",
+                                           {'pagina 1', 'pagina 2'})])
+
+    def test_coda_vuota(self):
+        self.assertTrue(CodaTelegram(token=TOKEN, chat_id=CHAT_ID).svuota())
+        self.assertEqual(self.server.richieste, [])
+
+
+if __name__ == '__main__':
+    unittest.main()